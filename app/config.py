@@ -9,10 +9,36 @@ class Config:
     # Database settings
     BASE_DIR = Path(__file__).parent.parent
     DATABASE_PATH = BASE_DIR / "home_automation.db"
+    DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "4"))  # read-only connections
+    DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+    DB_WRITE_RETRIES = 5  # retries when another process holds the write lock
+    DB_WRITE_RETRY_DELAY = 0.05  # seconds, doubled after each retry
     
     # FastAPI server settings
     API_HOST = os.getenv("API_HOST", "0.0.0.0")
     API_PORT = int(os.getenv("API_PORT", "8000"))
+    API_WORKERS = int(os.getenv("API_WORKERS", "1"))  # uvicorn worker processes
+    
+    # Broadcast bus settings (change events from the leader worker to all workers)
+    BROADCAST_BUS = os.getenv("BROADCAST_BUS", "auto")  # auto, in_process or loopback
+    BUS_HOST = "127.0.0.1"
+    BUS_PORT = int(os.getenv("BUS_PORT", "8766"))
+    BUS_LOCK_PATH = BASE_DIR / ".api_leader.lock"  # held by the leader worker
+    STARTUP_LOCK_PATH = BASE_DIR / ".api_startup.lock"  # serializes schema setup
+    BUS_RETRY_INTERVAL = 1.0  # seconds between leader election attempts
+    BUS_MAX_BUFFER = 8 * 1024 * 1024  # bytes a follower may lag before it is cut off
+    
+    # REST response cache (bodies per endpoint, filters and data version)
+    RESPONSE_CACHE_SIZE = 256
+    
+    # Device listing: keyset pages, streamed NDJSON and gzip
+    DEVICE_PAGE_SIZE = 100  # default page size when paginating
+    DEVICE_PAGE_MAX = 1000
+    DEVICE_STREAM_BATCH = 500  # rows fetched from the cursor at a time
+    GZIP_MIN_SIZE = 1024  # bytes; smaller responses are sent uncompressed
+    
+    # Bulk control (POST /api/commands)
+    COMMANDS_MAX_BATCH = 1000
     
     # CORS settings
     CORS_ORIGINS = [
@@ -24,13 +50,55 @@ class Config:
     
     # WebSocket settings
     WS_HEARTBEAT_INTERVAL = 30  # seconds
+    WS_SEND_QUEUE_SIZE = 100  # outbound frames buffered per client
+    # What to do when a client's queue is full: drop (oldest frame),
+    # coalesce (replace the queue with one full_refresh) or disconnect
+    WS_QUEUE_POLICY = os.getenv("WS_QUEUE_POLICY", "coalesce")
+    WS_MAX_OVERFLOWS = 10  # evict a client after this many overflows (0 = never)
+    WS_SEND_TIMEOUT = 10.0  # evict a client whose socket stalls this long (seconds)
+    # Device changes within this window are merged into one frame (0 disables)
+    WS_COALESCE_WINDOW = float(os.getenv("WS_COALESCE_WINDOW", "0.025"))  # seconds
+    WS_COALESCE_MAX_DELAY = 0.1  # upper bound on the added latency (seconds)
+    WS_COALESCE_BYPASS_TYPES = ["lock", "garage"]  # safety-critical, sent immediately
+    WS_SNAPSHOT_CACHE_SIZE = 64  # initial_data frames cached per data version
+    WS_REPLAY_BUFFER_SIZE = 1000  # recent broadcasts kept for resuming clients
     
     # MCP settings
     MCP_SERVER_NAME = "home-automation-mcp"
     MCP_SERVER_VERSION = "1.0.0"
+    MCP_TOOL_CACHE_SIZE = 128  # read-only tool results kept per data version
+    
+    # Event log settings
+    EVENT_LOG_BATCH_SIZE = 100  # flush once this many events are pending
+    EVENT_LOG_FLUSH_INTERVAL = 0.5  # seconds between flushes otherwise
+    
+    # Event retention settings
+    EVENT_RETENTION_DEFAULT_DAYS = 30  # raw events kept per day partition
+    EVENT_RETENTION_DAYS = {  # per event_type overrides
+        "device_control": 30,
+        "mode_change": 90,
+        "fish_feeding": 90,
+        "watering": 30,
+        "ev_charging": 30,
+    }
+    EVENT_ROLLUP_RETENTION_DAYS = 365  # hourly summaries
+    EVENT_MAINTENANCE_INTERVAL = 3600  # seconds between maintenance runs
+    
+    # Stats settings
+    # Serve /api/stats from the trigger-maintained device_counters table
+    # instead of aggregating the devices table on every request
+    STATS_USE_COUNTERS = os.getenv("STATS_USE_COUNTERS", "1") == "1"
+    
+    # Change data capture settings
+    CHANGES_RETAIN_ROWS = 10000  # newest rows kept in the changes table
+    DELTA_MAX_CHANGES = 500  # larger backlogs are sent as a full_refresh
     
     # Update notification settings
-    UPDATE_CHECK_INTERVAL = 0.1  # 100ms polling interval (checks database for MCP changes)
+    # The MCP server pushes change notifications over loopback UDP; polling
+    # the changes table is only a fallback for lost notifications
+    CHANGE_NOTIFY_HOST = "127.0.0.1"
+    CHANGE_NOTIFY_PORT = int(os.getenv("CHANGE_NOTIFY_PORT", "8765"))
+    UPDATE_CHECK_INTERVAL = 2.0  # fallback polling interval in seconds
 
 
 config = Config()
@@ -1,10 +1,45 @@
 """Database connection and operations manager."""
-import json
+import asyncio
+import sqlite3
 import aiosqlite
+from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, AsyncIterator, Set, Tuple
 from datetime import datetime
 from app.config import config
+from app.utils import codec
+from app.db.device_actions import DeviceCommand, apply_action
+from app.db.event_log import EventLogWriter, EventInsertRow
+from app.db.event_store import (
+    EVENT_COLUMNS,
+    create_partition,
+    ensure_event_sequence,
+    migrate_legacy_events,
+    partition_day,
+    partition_name,
+    reserve_event_ids,
+)
+from app.db.scenes import CompiledScene
+
+
+# Columns returned for a device (excludes the generated property columns)
+DEVICE_FIELDS = ["id", "type", "room", "state", "properties", "last_updated"]
+DEVICE_COLUMNS = ", ".join(DEVICE_FIELDS)
+
+# Frequently filtered properties, exposed as indexed generated columns
+# (prop_<name>) so predicates on them can be pushed down to SQL
+HOT_PROPERTIES = ["brightness", "position", "target_temp", "battery_level", "zone"]
+
+PROPERTY_OPERATORS = {"=", "!=", "<", "<=", ">", ">="}
+
+# (property, operator, value), e.g. ("position", ">", 50)
+PropertyPredicate = Tuple[str, str, Any]
+
+# (device_id, state, properties) - None leaves the column unchanged
+DeviceUpdateRow = Tuple[str, Optional[str], Optional[Dict[str, Any]]]
+
+# (event_type, device_id, action, metadata)
+EventRow = Tuple[str, Optional[str], Optional[str], Optional[Dict[str, Any]]]
 
 
 class Database:
@@ -12,23 +47,123 @@ class Database:
     
     def __init__(self, db_path: Path = config.DATABASE_PATH):
         self.db_path = db_path
-        self._connection: Optional[aiosqlite.Connection] = None
+        self._connection: Optional[aiosqlite.Connection] = None  # writer
+        self._readers: List[aiosqlite.Connection] = []
+        self._reader_pool: Optional[asyncio.Queue] = None
+        self._write_lock = asyncio.Lock()
+        self._transaction_owner: Optional[asyncio.Task] = None
+        self._version_connection: Optional[aiosqlite.Connection] = None
+        self._transaction_events: List[EventInsertRow] = []  # queued at COMMIT
+        
+        # Buffered audit log writer, started by the server lifespans
+        self.event_log = EventLogWriter(self)
+        self._event_partitions = set()  # partitions known to exist
+        
+        # In-memory device registry (see _ensure_registry)
+        self._registry: Dict[str, Dict[str, Any]] = {}
+        self._registry_by_room: Dict[Optional[str], List[str]] = {}
+        self._registry_by_type: Dict[str, List[str]] = {}
+        self._registry_order: List[str] = []
+        self._registry_version: Optional[int] = None
+        self._registry_seq: Optional[int] = None  # last change seq applied
+        self._registry_lock = asyncio.Lock()  # one sync at a time
+        self._registry_written: Set[str] = set()  # written through during a sync
     
     async def connect(self):
-        """Establish database connection."""
-        self._connection = await aiosqlite.connect(
-            self.db_path,
-            isolation_level=None  # Autocommit mode for better concurrency
+        """
+        Establish database connections.
+        
+        Opens one writer connection plus ``config.DB_READ_POOL_SIZE`` read-only
+        connections. Under WAL readers never wait for the writer, so reads no
+        longer queue behind writes on a single aiosqlite thread. A separate
+        read-only connection answers ``PRAGMA data_version`` checks.
+        """
+        self._connection = await self._open_connection(str(self.db_path))
+        await self._pragma(self._connection, "journal_mode=WAL")  # Write-Ahead Logging
+        
+        self._reader_pool = asyncio.Queue()
+        read_uri = f"{Path(self.db_path).resolve().as_uri()}?mode=ro"
+        for _ in range(config.DB_READ_POOL_SIZE):
+            reader = await self._open_connection(read_uri, uri=True)
+            self._readers.append(reader)
+            self._reader_pool.put_nowait(reader)
+        self._version_connection = await self._open_connection(read_uri, uri=True)
+    
+    async def _open_connection(self, database: str, **kwargs) -> aiosqlite.Connection:
+        """Open a connection with the shared settings."""
+        connection = await aiosqlite.connect(
+            database,
+            isolation_level=None,  # Autocommit mode for better concurrency
+            **kwargs
         )
-        self._connection.row_factory = aiosqlite.Row
-        await self._connection.execute("PRAGMA journal_mode=WAL")  # Write-Ahead Logging
+        connection.row_factory = aiosqlite.Row
+        await self._pragma(connection, f"busy_timeout = {config.DB_BUSY_TIMEOUT_MS}")
+        return connection
+    
+    @staticmethod
+    async def _pragma(connection: aiosqlite.Connection, pragma: str):
+        """
+        Run a PRAGMA and finish its statement.
+        
+        Setting PRAGMAs return a row; an unread cursor keeps the statement
+        active, which makes later DDL on the connection (e.g. DROP INDEX in
+        the schema migration) fail with "database table is locked".
+        """
+        async with connection.execute(f"PRAGMA {pragma}") as cursor:
+            await cursor.fetchall()
         
     async def disconnect(self):
-        """Close database connection."""
+        """Close database connections."""
+        for reader in self._readers:
+            await reader.close()
+        self._readers = []
+        self._reader_pool = None
+        
+        if self._version_connection:
+            await self._version_connection.close()
+            self._version_connection = None
+        
         if self._connection:
             await self._connection.close()
             self._connection = None
     
+    @asynccontextmanager
+    async def reader(self):
+        """
+        Borrow a read-only connection from the pool.
+        
+        Inside a transaction the writer is used instead, so the owning task
+        sees its own uncommitted changes.
+        """
+        if not self._readers or self._transaction_owner is asyncio.current_task():
+            yield self._connection
+            return
+        
+        connection = await self._reader_pool.get()
+        try:
+            yield connection
+        finally:
+            self._reader_pool.put_nowait(connection)
+    
+    @asynccontextmanager
+    async def read_transaction(self):
+        """
+        Borrow a reader inside a read transaction for a consistent snapshot.
+        
+        Under WAL every statement in the transaction sees the same committed
+        state, even while other connections write.
+        """
+        async with self.reader() as conn:
+            if conn is self._connection:
+                yield conn
+                return
+            
+            await conn.execute("BEGIN")
+            try:
+                yield conn
+            finally:
+                await conn.execute("COMMIT")
+    
     async def initialize_schema(self):
         """Initialize database schema from SQL file."""
         schema_path = Path(__file__).parent / "schema.sql"
@@ -37,25 +172,152 @@ class Database:
         
         await self._connection.executescript(schema_sql)
         await self._connection.commit()
+        async with self.transaction() as conn:
+            await migrate_legacy_events(conn)
+            await ensure_event_sequence(conn)
+        await self.ensure_property_columns()
+        await self.rebuild_counters()
+    
+    async def ensure_property_columns(self):
+        """Add generated columns and indexes for HOT_PROPERTIES (migration)."""
+        async with self._connection.execute("PRAGMA table_xinfo(devices)") as cursor:
+            existing = {row["name"] for row in await cursor.fetchall()}
+        
+        async with self.transaction() as conn:
+            for prop in HOT_PROPERTIES:
+                column = f"prop_{prop}"
+                if column not in existing:
+                    await conn.execute(
+                        f"""ALTER TABLE devices ADD COLUMN {column}
+                            GENERATED ALWAYS AS (json_extract(properties, '$.{prop}')) VIRTUAL"""
+                    )
+                await conn.execute(
+                    f"CREATE INDEX IF NOT EXISTS idx_devices_{column} ON devices(type, {column})"
+                )
+    
+    async def rebuild_counters(self):
+        """Recompute the device_counters table from the devices table."""
+        async with self.transaction() as conn:
+            await conn.execute("DELETE FROM device_counters")
+            await conn.execute(
+                """INSERT INTO device_counters (type, state, count)
+                   SELECT type, state, COUNT(*) FROM devices GROUP BY type, state"""
+            )
+    
+    @asynccontextmanager
+    async def transaction(self):
+        """
+        Run the enclosed writes in one explicit transaction (a single commit).
+        
+        Nested use from the same task joins the outer transaction, so the
+        single-row helpers can be called inside a batch without committing.
+        Events logged to the buffered event log inside the transaction are
+        only queued once it commits.
+        """
+        if self._transaction_owner is asyncio.current_task():
+            yield self._connection
+            return
+        
+        async with self._write_lock:
+            await self._begin_immediate()
+            self._transaction_owner = asyncio.current_task()
+            try:
+                yield self._connection
+            except BaseException:
+                await self._connection.execute("ROLLBACK")
+                # Write-through entries may describe rolled back changes
+                self.invalidate_registry()
+                raise
+            else:
+                await self._connection.execute("COMMIT")
+                if self._transaction_events:
+                    self.event_log.enqueue(self._transaction_events)
+            finally:
+                self._transaction_owner = None
+                self._transaction_events = []
+    
+    async def _begin_immediate(self):
+        """
+        Take the write lock, retrying while another process holds it.
+        
+        busy_timeout already waits inside SQLite; on top of that a short
+        exponential backoff covers the MCP and API processes writing at once.
+        """
+        for attempt in range(config.DB_WRITE_RETRIES + 1):
+            try:
+                await self._connection.execute("BEGIN IMMEDIATE")
+                return
+            except sqlite3.OperationalError as e:
+                busy = "locked" in str(e) or "busy" in str(e)
+                if not busy or attempt == config.DB_WRITE_RETRIES:
+                    raise
+                await asyncio.sleep(config.DB_WRITE_RETRY_DELAY * (2 ** attempt))
+    
+    async def get_data_version(self) -> int:
+        """
+        A version that changes whenever the database may have changed.
+        
+        ``PRAGMA data_version`` moves when a different connection commits.
+        It is read on a dedicated connection that never writes, so commits
+        from this instance's writer count too, and the check never queues
+        behind a write on the writer's thread.
+        """
+        async with self._version_connection.execute("PRAGMA data_version") as cursor:
+            return (await cursor.fetchone())[0]
     
     async def get_device(self, device_id: str) -> Optional[Dict[str, Any]]:
         """Get a single device by ID."""
-        async with self._connection.execute(
-            "SELECT * FROM devices WHERE id = ?", (device_id,)
-        ) as cursor:
-            row = await cursor.fetchone()
-            if row:
-                return self._row_to_dict(row)
-            return None
+        await self._ensure_registry()
+        device = self._registry.get(device_id)
+        return self._copy_device(device) if device else None
     
     async def get_devices(
         self, 
         room: Optional[str] = None, 
-        device_type: Optional[str] = None
+        device_type: Optional[str] = None,
+        where: Optional[List[PropertyPredicate]] = None
     ) -> List[Dict[str, Any]]:
-        """Get devices with optional filters."""
-        query = "SELECT * FROM devices WHERE 1=1"
-        params = []
+        """
+        Get devices with optional filters, ordered by room and type.
+        
+        Args:
+            room: Only devices in this room
+            device_type: Only devices of this type
+            where: Property predicates such as ``[("position", ">", 50)]``;
+                properties must be listed in HOT_PROPERTIES and are evaluated
+                in SQL against their indexed generated columns
+        """
+        if where:
+            return await self._query_devices(room, device_type, where)
+        
+        await self._ensure_registry()
+        
+        # Walk the smaller secondary index and filter on the other attribute
+        if room and device_type:
+            by_room = self._registry_by_room.get(room, [])
+            by_type = self._registry_by_type.get(device_type, [])
+            if len(by_room) <= len(by_type):
+                ids = [i for i in by_room if self._registry[i]["type"] == device_type]
+            else:
+                ids = [i for i in by_type if self._registry[i]["room"] == room]
+        elif room:
+            ids = self._registry_by_room.get(room, [])
+        elif device_type:
+            ids = self._registry_by_type.get(device_type, [])
+        else:
+            ids = self._registry_order
+        
+        return [self._copy_device(self._registry[i]) for i in ids]
+    
+    async def _query_devices(
+        self,
+        room: Optional[str],
+        device_type: Optional[str],
+        where: List[PropertyPredicate]
+    ) -> List[Dict[str, Any]]:
+        """Run a device query with property predicates pushed down to SQL."""
+        query = f"SELECT {DEVICE_COLUMNS} FROM devices WHERE 1=1"
+        params: List[Any] = []
         
         if room:
             query += " AND room = ?"
@@ -65,12 +327,120 @@ class Database:
             query += " AND type = ?"
             params.append(device_type)
         
-        query += " ORDER BY room, type"
+        for prop, operator, value in where:
+            if prop not in HOT_PROPERTIES:
+                raise ValueError(f"Property '{prop}' is not indexed. Use one of: {', '.join(HOT_PROPERTIES)}")
+            if operator not in PROPERTY_OPERATORS:
+                raise ValueError(f"Unsupported operator '{operator}'")
+            query += f" AND prop_{prop} {operator} ?"
+            params.append(value)
         
-        async with self._connection.execute(query, params) as cursor:
-            rows = await cursor.fetchall()
-            return [self._row_to_dict(row) for row in rows]
-    
+        query += " ORDER BY room, type, id"
+        
+        async with self.reader() as conn:
+            async with conn.execute(query, params) as cursor:
+                rows = await cursor.fetchall()
+                return [self._row_to_dict(row) for row in rows]
+
+    @staticmethod
+    def device_fields(fields: Optional[List[str]] = None) -> List[str]:
+        """
+        Validate a field projection; ``id`` is always included.
+
+        Raises ValueError for unknown fields.
+        """
+        if not fields:
+            return list(DEVICE_FIELDS)
+        unknown = [f for f in fields if f not in DEVICE_FIELDS]
+        if unknown:
+            raise ValueError(
+                f"Unknown field(s): {', '.join(unknown)}. Must be among {', '.join(DEVICE_FIELDS)}"
+            )
+        return [f for f in DEVICE_FIELDS if f == "id" or f in fields]
+
+    async def iter_devices(
+        self,
+        room: Optional[str] = None,
+        device_type: Optional[str] = None,
+        after_id: Optional[str] = None,
+        limit: Optional[int] = None,
+        fields: Optional[List[str]] = None,
+        batch_size: int = config.DEVICE_STREAM_BATCH
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Stream devices in ID order, one keyset batch at a time.
+
+        Each batch of ``batch_size`` rows is read with its own short reader
+        borrow and yielded after the reader is returned, so a slow consumer
+        (e.g. a streamed HTTP response) never holds a pooled connection and
+        a full inventory is never held in memory. Batches are separate reads,
+        so a stream may mix rows from before and after a concurrent write.
+
+        Args:
+            room: Only devices in this room
+            device_type: Only devices of this type
+            after_id: Continue after this device ID (keyset pagination,
+                served by the (room, id) / (type, id) indexes)
+            limit: Stop after this many devices
+            fields: Columns to return (see ``device_fields``); properties
+                are only decoded when selected
+        """
+        columns = self.device_fields(fields)
+        query = f"SELECT {', '.join(columns)} FROM devices WHERE 1=1"
+        params: List[Any] = []
+
+        if room:
+            query += " AND room = ?"
+            params.append(room)
+
+        if device_type:
+            query += " AND type = ?"
+            params.append(device_type)
+
+        query += " AND id > ? ORDER BY id LIMIT ?"
+        remaining = limit
+
+        while remaining is None or remaining > 0:
+            count = batch_size if remaining is None else min(batch_size, remaining)
+            # Every ID sorts after "", so the first batch starts at the beginning
+            async with self.reader() as conn:
+                async with conn.execute(query, [*params, after_id or "", count]) as cursor:
+                    rows = await cursor.fetchall()
+
+            for row in rows:
+                yield self._row_to_dict(row)
+            if len(rows) < count:
+                return
+            after_id = rows[-1]["id"]
+            if remaining is not None:
+                remaining -= len(rows)
+
+    async def get_devices_page(
+        self,
+        room: Optional[str] = None,
+        device_type: Optional[str] = None,
+        after_id: Optional[str] = None,
+        limit: int = config.DEVICE_PAGE_SIZE,
+        fields: Optional[List[str]] = None
+    ) -> Dict[str, Any]:
+        """
+        Get one page of devices in ID order.
+
+        Pass the returned ``next_after_id`` as ``after_id`` to fetch the next
+        page; it is None on the last page.
+        """
+        devices = [
+            device async for device in self.iter_devices(
+                room, device_type, after_id=after_id, limit=limit + 1, fields=fields
+            )
+        ]
+        has_more = len(devices) > limit
+        devices = devices[:limit]
+        return {
+            "devices": devices,
+            "next_after_id": devices[-1]["id"] if has_more else None
+        }
+
     async def update_device(
         self, 
         device_id: str, 
@@ -87,7 +457,7 @@ class Database:
         
         if properties is not None:
             updates.append("properties = ?")
-            params.append(json.dumps(properties))
+            params.append(codec.dumps(properties))
         
         if updates:
             updates.append("last_updated = ?")
@@ -95,9 +465,187 @@ class Database:
             params.append(device_id)
             
             query = f"UPDATE devices SET {', '.join(updates)} WHERE id = ?"
-            await self._connection.execute(query, params)
-            await self._connection.commit()
+            async with self.transaction() as conn:
+                await conn.execute(query, params)
+            self._registry_update(device_id, state, properties, params[-2])
     
+    async def update_devices_bulk(
+        self,
+        updates: List[DeviceUpdateRow],
+        events: Optional[List[EventRow]] = None
+    ):
+        """
+        Update many devices and log their events in a single transaction.
+        
+        Args:
+            updates: (device_id, state, properties) tuples; a None state or
+                properties keeps the stored value
+            events: (event_type, device_id, action, metadata) tuples
+        """
+        if not updates and not events:
+            return
+        
+        now = datetime.now().isoformat()
+        async with self.transaction() as conn:
+            if updates:
+                await conn.executemany(
+                    """UPDATE devices
+                       SET state = COALESCE(?, state),
+                           properties = COALESCE(?, properties),
+                           last_updated = ?
+                       WHERE id = ?""",
+                    [
+                        (
+                            state,
+                            codec.dumps(properties) if properties is not None else None,
+                            now,
+                            device_id
+                        )
+                        for device_id, state, properties in updates
+                    ]
+                )
+            if events:
+                await self.log_events_bulk(events)
+        
+        for device_id, state, properties in updates:
+            self._registry_update(device_id, state, properties, now)
+
+    async def execute_commands(
+        self,
+        commands: List[DeviceCommand],
+        atomic: bool = False
+    ) -> List[Dict[str, Any]]:
+        """
+        Apply device commands in order within a single transaction.
+
+        The targets of every command are read with one query inside the
+        transaction, each command sees the effect of the commands before it,
+        and all updates and their events are written together. Commands whose
+        selector matches nothing are skipped, unless ``atomic`` is set: then
+        nothing at all is written when any command fails.
+
+        Raises ValueError (before writing anything) for an invalid command.
+        Returns one result per command: ``{"error": ..., "devices": [...]}``,
+        where ``error`` is set when the selector matched nothing and each
+        device entry has ``device_id``, ``room``, ``device_type``,
+        ``previous_state``, ``state``, ``properties`` and ``changed``.
+        """
+        if not commands:
+            return []
+        for command in commands:
+            command.validate()
+
+        now = datetime.now().isoformat()
+        async with self.transaction() as conn:
+            devices = await self._select_command_targets(conn, commands)
+            by_room: Dict[Optional[str], List[Dict[str, Any]]] = {}
+            by_type: Dict[str, List[Dict[str, Any]]] = {}
+            for device in devices.values():
+                by_room.setdefault(device["room"], []).append(device)
+                by_type.setdefault(device["type"], []).append(device)
+
+            results = []
+            updated: Dict[str, Dict[str, Any]] = {}
+            events: List[EventRow] = []
+            for command in commands:
+                if command.device_id:
+                    targets = [devices[command.device_id]] if command.device_id in devices else []
+                elif command.room:
+                    targets = [
+                        d for d in by_room.get(command.room, [])
+                        if not command.device_type or d["type"] == command.device_type
+                    ]
+                elif command.device_type:
+                    targets = by_type.get(command.device_type, [])
+                else:
+                    targets = list(devices.values())
+
+                if not targets:
+                    results.append({"error": command.not_found(), "devices": []})
+                    continue
+
+                changes = []
+                for device in targets:
+                    new_state, new_properties = apply_action(device, command.action, **(command.params or {}))
+                    previous_state = device["state"]
+                    changed = bool(new_state) or new_properties != device["properties"]
+                    if changed:
+                        device["state"] = new_state or previous_state
+                        device["properties"] = new_properties
+                        updated[device["id"]] = device
+                        events.append((
+                            "device_control",
+                            device["id"],
+                            command.action,
+                            {"new_state": new_state, "properties": new_properties}
+                        ))
+                    changes.append({
+                        "device_id": device["id"],
+                        "room": device["room"],
+                        "device_type": device["type"],
+                        "previous_state": previous_state,
+                        "state": device["state"],
+                        "properties": device["properties"],
+                        "changed": changed
+                    })
+                results.append({"error": None, "devices": changes})
+
+            if atomic and any(result["error"] for result in results):
+                return results
+
+            if updated:
+                await conn.executemany(
+                    "UPDATE devices SET state = ?, properties = ?, last_updated = ? WHERE id = ?",
+                    [
+                        (device["state"], codec.dumps(device["properties"]), now, device_id)
+                        for device_id, device in updated.items()
+                    ]
+                )
+                await self.log_events_bulk(events)
+
+        for device_id, device in updated.items():
+            self._registry_update(device_id, device["state"], device["properties"], now)
+        return results
+
+    async def _select_command_targets(
+        self,
+        conn: aiosqlite.Connection,
+        commands: List[DeviceCommand]
+    ) -> Dict[str, Dict[str, Any]]:
+        """Read every device any of the commands may target in one query."""
+        ids, rooms, types, pairs = set(), set(), set(), set()
+        for command in commands:
+            if command.device_id:
+                ids.add(command.device_id)
+            elif command.room and command.device_type:
+                pairs.add((command.room, command.device_type))
+            elif command.room:
+                rooms.add(command.room)
+            elif command.device_type:
+                types.add(command.device_type)
+            else:
+                # A command without a selector targets every device
+                ids = rooms = types = pairs = None
+                break
+
+        query = f"SELECT {DEVICE_COLUMNS} FROM devices"
+        params: List[Any] = []
+        if ids is not None:
+            clauses = []
+            for column, values in (("id", ids), ("room", rooms), ("type", types)):
+                if values:
+                    clauses.append(f"{column} IN ({', '.join('?' * len(values))})")
+                    params.extend(values)
+            if pairs:
+                clauses.append(f"(room, type) IN (VALUES {', '.join(['(?, ?)'] * len(pairs))})")
+                params.extend(value for pair in pairs for value in pair)
+            query += f" WHERE {' OR '.join(clauses)}"
+        query += " ORDER BY room, type, id"
+
+        async with conn.execute(query, params) as cursor:
+            rows = await cursor.fetchall()
+        return {row["id"]: self._row_to_dict(row) for row in rows}
+
     async def log_event(
         self, 
         event_type: str, 
@@ -106,108 +654,599 @@ class Database:
         metadata: Optional[Dict[str, Any]] = None
     ):
         """Log an event to the events table."""
-        await self._connection.execute(
-            """INSERT INTO events (event_type, device_id, action, metadata, timestamp)
-               VALUES (?, ?, ?, ?, ?)""",
+        await self.log_events_bulk([(event_type, device_id, action, metadata)])
+    
+    async def log_events_bulk(self, events: List[EventRow]):
+        """
+        Log many events.
+        
+        While the buffered event log writer is running the events are queued
+        and group-committed later (inside a transaction, only once it
+        commits); otherwise they are inserted immediately.
+        """
+        if not events:
+            return
+        
+        now = datetime.now().isoformat()
+        rows = [
             (
                 event_type,
                 device_id,
                 action,
-                json.dumps(metadata) if metadata else None,
-                datetime.now().isoformat()
+                codec.dumps(metadata) if metadata else None,
+                now
             )
-        )
-        await self._connection.commit()
+            for event_type, device_id, action, metadata in events
+        ]
+        
+        if not self.event_log.running:
+            await self.insert_events(rows)
+        elif self._transaction_owner is asyncio.current_task():
+            self._transaction_events.extend(rows)
+        else:
+            self.event_log.enqueue(rows)
+    
+    async def insert_events(self, rows: List[EventInsertRow]):
+        """
+        Insert encoded event rows in a single transaction.
+        
+        Rows are routed to their day partition, creating it on first use,
+        with one executemany per partition. Ids come from the shared event
+        sequence, so they are unique across partitions.
+        """
+        if not rows:
+            return
+        
+        async with self.transaction() as conn:
+            first_id = await reserve_event_ids(conn, len(rows))
+            by_partition: Dict[str, List[Tuple[Any, ...]]] = {}
+            for event_id, row in enumerate(rows, first_id):
+                by_partition.setdefault(partition_day(row[4]), []).append((event_id, *row))
+            
+            for day, day_rows in by_partition.items():
+                name = partition_name(day)
+                if name not in self._event_partitions:
+                    await create_partition(conn, day)
+                    self._event_partitions.add(name)
+                
+                await conn.executemany(
+                    f"""INSERT INTO {name} (id, event_type, device_id, action, metadata, timestamp)
+                        VALUES (?, ?, ?, ?, ?, ?)""",
+                    day_rows
+                )
+    
+    async def query_events(
+        self,
+        device_id: Optional[str] = None,
+        event_type: Optional[str] = None,
+        action: Optional[str] = None,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+        after_id: Optional[int] = None,
+        limit: int = 50
+    ) -> Dict[str, Any]:
+        """
+        Read events newest first with keyset pagination.
+        
+        Day partitions are visited newest first and each is queried with an
+        indexed seek on (device_id, timestamp) or (event_type, timestamp),
+        stopping once ``limit`` rows are found. Pass the returned
+        ``next_after_id`` as ``after_id`` to fetch the next page.
+        
+        Args:
+            device_id: Only events for this device
+            event_type: Only events of this type
+            action: Only events with this action
+            since: ISO timestamp lower bound (inclusive)
+            until: ISO timestamp upper bound (inclusive)
+            after_id: Continue after this event ID (from a previous page)
+            limit: Maximum number of events to return
+        """
+        # Make our own pending audit events visible
+        if self.event_log.running:
+            await self.event_log.flush()
+        
+        async with self.reader() as conn:
+            cursor_key = None
+            if after_id is not None:
+                async with conn.execute(
+                    "SELECT timestamp, id FROM events WHERE id = ?", (after_id,)
+                ) as cursor:
+                    row = await cursor.fetchone()
+                if row is None:
+                    return {"events": [], "next_after_id": None}
+                cursor_key = (row[0], row[1])
+            
+            query = "SELECT name FROM event_partitions WHERE 1=1"
+            params: List[Any] = []
+            if since:
+                query += " AND day >= ?"
+                params.append(partition_day(since))
+            upper_days = [partition_day(until)] if until else []
+            if cursor_key:
+                upper_days.append(partition_day(cursor_key[0]))
+            if upper_days:
+                query += " AND day <= ?"
+                params.append(min(upper_days))
+            query += " ORDER BY day DESC"
+            
+            async with conn.execute(query, params) as cursor:
+                partitions = [row[0] for row in await cursor.fetchall()]
+            
+            conditions = []
+            filter_params: List[Any] = []
+            if device_id:
+                conditions.append("device_id = ?")
+                filter_params.append(device_id)
+            if event_type:
+                conditions.append("event_type = ?")
+                filter_params.append(event_type)
+            if action:
+                conditions.append("action = ?")
+                filter_params.append(action)
+            if since:
+                conditions.append("timestamp >= ?")
+                filter_params.append(since)
+            if until:
+                conditions.append("timestamp <= ?")
+                filter_params.append(until)
+            if cursor_key:
+                conditions.append("(timestamp, id) < (?, ?)")
+                filter_params.extend(cursor_key)
+            where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+            
+            # Fetch one extra row to know whether another page exists
+            events = []
+            for name in partitions:
+                remaining = limit + 1 - len(events)
+                async with conn.execute(
+                    f"""SELECT {EVENT_COLUMNS} FROM {name} {where}
+                        ORDER BY timestamp DESC, id DESC LIMIT ?""",
+                    (*filter_params, remaining)
+                ) as cursor:
+                    events.extend(self._event_row_to_dict(row) for row in await cursor.fetchall())
+                if len(events) > limit:
+                    break
+        
+        has_more = len(events) > limit
+        events = events[:limit]
+        return {
+            "events": events,
+            "next_after_id": events[-1]["id"] if has_more else None
+        }
+    
+    async def get_change_seq(self) -> int:
+        """Get the latest change sequence number."""
+        async with self.reader() as conn:
+            return await self._max_change_seq(conn)
+    
+    async def get_changes_since(self, seq: int, limit: int = 1000) -> List[Dict[str, Any]]:
+        """
+        Get change rows after a sequence number (an indexed range scan).
+        
+        Each row has ``seq``, ``device_id`` (the mode name for ``op='mode'``),
+        ``op`` (insert, update, delete, mode) and ``changed_at``.
+        """
+        async with self.reader() as conn:
+            async with conn.execute(
+                """SELECT seq, device_id, op, changed_at FROM changes
+                   WHERE seq > ? ORDER BY seq LIMIT ?""",
+                (seq, limit)
+            ) as cursor:
+                return [dict(row) for row in await cursor.fetchall()]
+    
+    async def get_devices_by_ids(self, device_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Read specific devices straight from SQLite, keyed by ID."""
+        async with self.reader() as conn:
+            return await self._fetch_devices(conn, device_ids)
+    
+    async def get_changes_delta(
+        self,
+        seq: int,
+        limit: int = config.DELTA_MAX_CHANGES
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Collect everything that changed after a sequence number.
+        
+        Changes, device rows and stats are read in one read transaction so the
+        delta is a consistent snapshot. Returns None when nothing changed,
+        otherwise a dict with:
+        
+        - ``seq``: sequence number to pass in next time
+        - ``complete``: False when more than ``limit`` changes are pending or
+          the changes were compacted past ``seq``; the caller should fall
+          back to a full refresh (``devices``/``deleted``/``stats`` are empty)
+        - ``devices``: current rows of inserted/updated devices
+        - ``deleted``: IDs of deleted devices
+        - ``mode``: the last activated home mode, if any
+        - ``stats``: dashboard statistics after the changes
+        """
+        async with self.read_transaction() as conn:
+            async with conn.execute(
+                "SELECT seq, device_id, op FROM changes WHERE seq > ? ORDER BY seq LIMIT ?",
+                (seq, limit + 1)
+            ) as cursor:
+                changes = await cursor.fetchall()
+            
+            if not changes:
+                return None
+            
+            delta = {
+                "seq": changes[-1]["seq"],
+                "complete": True,
+                "devices": [],
+                "deleted": [],
+                "mode": None,
+                "stats": None
+            }
+            
+            # Sequence numbers are contiguous, so a jump means compaction
+            if len(changes) > limit or changes[0]["seq"] != seq + 1:
+                delta["complete"] = False
+                delta["seq"] = await self._max_change_seq(conn)
+                return delta
+            
+            # Last operation per device wins
+            ops: Dict[str, str] = {}
+            for change in changes:
+                if change["op"] == "mode":
+                    delta["mode"] = change["device_id"]
+                else:
+                    ops[change["device_id"]] = change["op"]
+            
+            changed_ids = [device_id for device_id, op in ops.items() if op != "delete"]
+            devices = await self._fetch_devices(conn, changed_ids)
+            delta["devices"] = [devices[device_id] for device_id in changed_ids if device_id in devices]
+            delta["deleted"] = [device_id for device_id, op in ops.items() if op == "delete"]
+            delta["stats"] = await self._query_stats(conn)
+            return delta
+    
+    async def compact_changes(self, keep: int = config.CHANGES_RETAIN_ROWS) -> int:
+        """Delete all but the newest ``keep`` change rows. Returns rows deleted."""
+        async with self.transaction() as conn:
+            cursor = await conn.execute(
+                "DELETE FROM changes WHERE seq <= (SELECT MAX(seq) FROM changes) - ?",
+                (keep,)
+            )
+            return cursor.rowcount
+    
+    async def _max_change_seq(self, conn: aiosqlite.Connection) -> int:
+        """Latest change sequence number (a primary key lookup)."""
+        async with conn.execute("SELECT COALESCE(MAX(seq), 0) FROM changes") as cursor:
+            return (await cursor.fetchone())[0]
+    
+    async def _fetch_devices(
+        self,
+        conn: aiosqlite.Connection,
+        device_ids: List[str]
+    ) -> Dict[str, Dict[str, Any]]:
+        """Read devices by ID on the given connection."""
+        devices = {}
+        # Stay well below SQLite's bound parameter limit
+        for i in range(0, len(device_ids), 500):
+            chunk = device_ids[i:i + 500]
+            async with conn.execute(
+                f"SELECT {DEVICE_COLUMNS} FROM devices WHERE id IN ({', '.join('?' * len(chunk))})",
+                chunk
+            ) as cursor:
+                for row in await cursor.fetchall():
+                    devices[row["id"]] = self._row_to_dict(row)
+        return devices
     
     async def get_rooms(self) -> List[str]:
         """Get list of unique rooms."""
-        async with self._connection.execute(
-            "SELECT DISTINCT room FROM devices WHERE room IS NOT NULL ORDER BY room"
-        ) as cursor:
-            rows = await cursor.fetchall()
-            return [row[0] for row in rows]
+        await self._ensure_registry()
+        return sorted(room for room in self._registry_by_room if room is not None)
     
     async def get_active_mode(self) -> Optional[str]:
         """Get currently active home mode."""
-        async with self._connection.execute(
-            "SELECT mode FROM home_modes WHERE is_active = 1"
-        ) as cursor:
-            row = await cursor.fetchone()
-            return row[0] if row else None
+        async with self.reader() as conn:
+            async with conn.execute(
+                "SELECT mode FROM home_modes WHERE is_active = 1"
+            ) as cursor:
+                row = await cursor.fetchone()
+                return row[0] if row else None
     
     async def set_home_mode(self, mode: str):
         """Set active home mode."""
-        # Deactivate all modes
-        await self._connection.execute("UPDATE home_modes SET is_active = 0")
-        
-        # Activate selected mode
-        await self._connection.execute(
-            """UPDATE home_modes 
-               SET is_active = 1, last_activated = ? 
-               WHERE mode = ?""",
-            (datetime.now().isoformat(), mode)
-        )
-        await self._connection.commit()
+        async with self.transaction() as conn:
+            # Deactivate all modes
+            await conn.execute("UPDATE home_modes SET is_active = 0")
+            
+            # Activate selected mode
+            await conn.execute(
+                """UPDATE home_modes 
+                   SET is_active = 1, last_activated = ? 
+                   WHERE mode = ?""",
+                (datetime.now().isoformat(), mode)
+            )
+    
+    async def apply_scene(self, scene: CompiledScene) -> List[Dict[str, Any]]:
+        """
+        Apply a compiled scene in one transaction.
+        
+        Only rows whose state or properties differ from the scene are written.
+        Returns the changed devices, each with an ``action`` description.
+        """
+        now = datetime.now().isoformat()
+        changed = []
+        async with self.transaction() as conn:
+            for statement in scene.statements:
+                async with conn.execute(statement.sql, statement.params(now)) as cursor:
+                    for row in await cursor.fetchall():
+                        device = self._row_to_dict(row)
+                        device["action"] = statement.describe(device)
+                        changed.append(device)
+        
+        for device in changed:
+            self._registry_update(
+                device["id"], device["state"], device["properties"], device["last_updated"]
+            )
+        return changed
     
     async def get_stats(self) -> Dict[str, Any]:
-        """Get dashboard statistics."""
+        """
+        Get dashboard statistics.
+        
+        Counts come from one grouped query: either a primary-key scan of the
+        trigger-maintained device_counters table or a single aggregate over
+        devices, depending on ``config.STATS_USE_COUNTERS``.
+        """
+        async with self.reader() as conn:
+            return await self._query_stats(conn)
+    
+    async def _query_stats(self, conn: aiosqlite.Connection) -> Dict[str, Any]:
+        """Run the stats query on the given connection."""
+        if config.STATS_USE_COUNTERS:
+            query = """SELECT type, state, count,
+                              (SELECT mode FROM home_modes WHERE is_active = 1)
+                       FROM device_counters WHERE count > 0"""
+        else:
+            query = """SELECT type, state, COUNT(*),
+                              (SELECT mode FROM home_modes WHERE is_active = 1)
+                       FROM devices GROUP BY type, state"""
+        
+        async with conn.execute(query) as cursor:
+            rows = await cursor.fetchall()
+        
+        stats = self._build_stats(rows)
+        if not rows:
+            async with conn.execute(
+                "SELECT mode FROM home_modes WHERE is_active = 1"
+            ) as cursor:
+                row = await cursor.fetchone()
+                stats["active_mode"] = row[0] if row else None
+        return stats
+
+    async def get_snapshot(self) -> Dict[str, Any]:
+        """
+        Get everything the dashboard shows, read in one read transaction.
+
+        Returns ``devices`` (ordered by room and type), ``rooms``, ``stats``,
+        ``active_mode`` and the change ``seq`` they reflect, all from the
+        same committed state.
+        """
+        async with self.read_transaction() as conn:
+            seq = await self._max_change_seq(conn)
+            async with conn.execute(
+                f"SELECT {DEVICE_COLUMNS} FROM devices ORDER BY room, type, id"
+            ) as cursor:
+                rows = await cursor.fetchall()
+            stats = await self._query_stats(conn)
+
+        devices = [self._row_to_dict(row) for row in rows]
+        return {
+            "devices": devices,
+            "rooms": sorted({device["room"] for device in devices if device["room"] is not None}),
+            "stats": stats,
+            "active_mode": stats["active_mode"],
+            "seq": seq
+        }
+    
+    def _build_stats(self, rows: List[aiosqlite.Row]) -> Dict[str, Any]:
+        """Build the stats payload from (type, state, count, active_mode) rows."""
         stats = {
             "lights": {"on": 0, "total": 0},
             "doors": {"locked": 0, "total": 0},
             "total_devices": 0,
             "garage_open": False,
-            "active_mode": None
+            "active_mode": None,
+            "by_type": {}
         }
         
-        # Count lights
-        async with self._connection.execute(
-            "SELECT COUNT(*) FROM devices WHERE type = 'light'"
-        ) as cursor:
-            stats["lights"]["total"] = (await cursor.fetchone())[0]
-        
-        async with self._connection.execute(
-            "SELECT COUNT(*) FROM devices WHERE type = 'light' AND state = 'on'"
-        ) as cursor:
-            stats["lights"]["on"] = (await cursor.fetchone())[0]
-        
-        # Count locks
-        async with self._connection.execute(
-            "SELECT COUNT(*) FROM devices WHERE type = 'lock'"
-        ) as cursor:
-            stats["doors"]["total"] = (await cursor.fetchone())[0]
-        
-        async with self._connection.execute(
-            "SELECT COUNT(*) FROM devices WHERE type = 'lock' AND state = 'locked'"
-        ) as cursor:
-            stats["doors"]["locked"] = (await cursor.fetchone())[0]
-        
-        # Total devices
-        async with self._connection.execute(
-            "SELECT COUNT(*) FROM devices"
-        ) as cursor:
-            stats["total_devices"] = (await cursor.fetchone())[0]
-        
-        # Check garage
-        async with self._connection.execute(
-            "SELECT state FROM devices WHERE type = 'garage'"
-        ) as cursor:
-            row = await cursor.fetchone()
-            if row:
-                stats["garage_open"] = row[0] == "open"
-        
-        # Active mode
-        stats["active_mode"] = await self.get_active_mode()
+        for device_type, state, count, active_mode in rows:
+            type_stats = stats["by_type"].setdefault(
+                device_type, {"total": 0, "states": {}}
+            )
+            type_stats["total"] += count
+            type_stats["states"][state] = count
+            stats["total_devices"] += count
+            stats["active_mode"] = active_mode
+        
+        lights = stats["by_type"].get("light", {"total": 0, "states": {}})
+        stats["lights"] = {"on": lights["states"].get("on", 0), "total": lights["total"]}
+        
+        locks = stats["by_type"].get("lock", {"total": 0, "states": {}})
+        stats["doors"] = {"locked": locks["states"].get("locked", 0), "total": locks["total"]}
+        
+        garages = stats["by_type"].get("garage", {"states": {}})
+        stats["garage_open"] = garages["states"].get("open", 0) > 0
         
         return stats
     
+    async def _ensure_registry(self):
+        """
+        Load the device registry, refreshing it if another connection wrote.
+        
+        The data version (see ``get_data_version``) changes whenever any
+        connection, including this instance's writer, commits. The registry
+        then re-reads only the devices listed in the changes table since it
+        was last synced, falling back to a full reload when that range has
+        been compacted away. Writes made through this instance also update
+        the registry directly, so it is current even before that sync.
+        
+        Syncs run one at a time. A local write that commits while a sync is
+        reading may be newer than the rows read, so those devices keep their
+        written-through value and the next access syncs again.
+        """
+        version = await self.get_data_version()
+        if version == self._registry_version:
+            return
+        
+        async with self._registry_lock:
+            if version == self._registry_version:
+                return
+            
+            self._registry_written.clear()
+            synced = None
+            if self._registry_seq is not None:
+                synced = await self._refresh_registry()
+            if synced is None:
+                synced = await self._load_registry()
+            if synced:
+                self._registry_version = version
+    
+    async def _load_registry(self) -> bool:
+        """Read every device into the registry; False if a local write raced the read."""
+        async with self.read_transaction() as conn:
+            seq = await self._max_change_seq(conn)
+            async with conn.execute(f"SELECT {DEVICE_COLUMNS} FROM devices") as cursor:
+                rows = await cursor.fetchall()
+        
+        registry = {row["id"]: self._row_to_dict(row) for row in rows}
+        raced = self._registry_written & registry.keys()
+        for device_id in raced:
+            if device_id in self._registry:
+                registry[device_id] = self._registry[device_id]
+        
+        self._registry = registry
+        # After a race the position is unknown, so reload again next time
+        self._registry_seq = None if raced else seq
+        self._rebuild_registry_indexes()
+        return not raced
+    
+    async def _refresh_registry(self) -> Optional[bool]:
+        """
+        Re-read devices changed since the registry was synced.
+        
+        Returns None when the changes were compacted past the registry's
+        position (a full reload is needed), otherwise whether the registry
+        is now in sync; after a race with a local write the position is
+        kept so the next sync re-reads the skipped devices.
+        """
+        async with self.read_transaction() as conn:
+            async with conn.execute("SELECT MIN(seq), MAX(seq) FROM changes") as cursor:
+                min_seq, max_seq = await cursor.fetchone()
+            
+            if max_seq is None or max_seq <= self._registry_seq:
+                return True
+            if min_seq > self._registry_seq + 1:
+                return None  # Changes were compacted past our position
+            
+            async with conn.execute(
+                "SELECT DISTINCT device_id FROM changes WHERE seq > ? AND op != 'mode'",
+                (self._registry_seq,)
+            ) as cursor:
+                device_ids = [row[0] for row in await cursor.fetchall()]
+            
+            rows = await self._fetch_devices(conn, device_ids)
+        
+        structural = False
+        raced = False
+        for device_id in device_ids:
+            if device_id in self._registry_written:
+                # Written through after the read began; may be newer than the row
+                raced = True
+                continue
+            row = rows.get(device_id)
+            current = self._registry.get(device_id)
+            if row is None:
+                if self._registry.pop(device_id, None) is not None:
+                    structural = True
+                continue
+            if current is None or (current["room"], current["type"]) != (row["room"], row["type"]):
+                structural = True
+            self._registry[device_id] = row
+        
+        if not raced:
+            self._registry_seq = max_seq
+        if structural:
+            self._rebuild_registry_indexes()
+        return not raced
+    
+    def _rebuild_registry_indexes(self):
+        """Recompute the registry ordering and room/type indexes."""
+        registry = self._registry
+        # Same ordering as ORDER BY room, type (NULL rooms first)
+        order = sorted(
+            registry,
+            key=lambda i: (
+                registry[i]["room"] is not None,
+                registry[i]["room"] or "",
+                registry[i]["type"],
+                i
+            )
+        )
+        by_room: Dict[Optional[str], List[str]] = {}
+        by_type: Dict[str, List[str]] = {}
+        for device_id in order:
+            device = registry[device_id]
+            by_room.setdefault(device["room"], []).append(device_id)
+            by_type.setdefault(device["type"], []).append(device_id)
+        
+        self._registry_order = order
+        self._registry_by_room = by_room
+        self._registry_by_type = by_type
+    
+    def invalidate_registry(self):
+        """Force the device registry to fully reload on next access."""
+        self._registry_version = None
+        self._registry_seq = None
+    
+    def _registry_update(
+        self,
+        device_id: str,
+        state: Optional[str],
+        properties: Optional[Dict[str, Any]],
+        last_updated: str
+    ):
+        """Write-through a device change into the registry."""
+        device = self._registry.get(device_id)
+        if device is None:
+            return
+        self._registry_written.add(device_id)
+        if state is not None:
+            device["state"] = state
+        if properties is not None:
+            device["properties"] = dict(properties)
+        device["last_updated"] = last_updated
+    
+    def _copy_device(self, device: Dict[str, Any]) -> Dict[str, Any]:
+        """Copy a registry entry so callers can mutate it freely."""
+        copy = dict(device)
+        copy["properties"] = dict(device["properties"])
+        return copy
+    
+    def _event_row_to_dict(self, row: aiosqlite.Row) -> Dict[str, Any]:
+        """Convert an event row to dictionary."""
+        data = dict(row)
+        if data.get("metadata"):
+            try:
+                data["metadata"] = codec.loads(data["metadata"])
+            except codec.JSONDecodeError:
+                data["metadata"] = None
+        return data
+    
     def _row_to_dict(self, row: aiosqlite.Row) -> Dict[str, Any]:
         """Convert database row to dictionary."""
         data = dict(row)
-        # Parse JSON properties
-        if data.get("properties"):
+        # Parse JSON properties (unless projected away)
+        if "properties" not in data:
+            return data
+        if data["properties"]:
             try:
-                data["properties"] = json.loads(data["properties"])
-            except json.JSONDecodeError:
+                data["properties"] = codec.loads(data["properties"])
+            except codec.JSONDecodeError:
                 data["properties"] = {}
         else:
             data["properties"] = {}
@@ -0,0 +1,151 @@
+"""Device actions shared by the MCP tools and the REST command endpoint."""
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+
+ACTIONS = ("on", "off", "open", "close", "set", "toggle", "lock", "unlock")
+
+# Optional parameters an action accepts
+ACTION_PARAMS = ("brightness", "position", "speed", "target_temp", "mode")
+
+
+class DeviceCommand(NamedTuple):
+    """
+    An action for the devices matched by a target selector.
+
+    ``device_id`` selects one device; otherwise every device in ``room``
+    and/or of ``device_type`` (no selector means every device). ``params``
+    holds the ACTION_PARAMS values given.
+    """
+    action: str
+    device_id: Optional[str] = None
+    room: Optional[str] = None
+    device_type: Optional[str] = None
+    params: Optional[Dict[str, Any]] = None
+
+    def validate(self):
+        """Raise ValueError for an unknown action or parameter."""
+        if self.action not in ACTIONS:
+            raise ValueError(f"Invalid action '{self.action}'. Must be one of: {', '.join(ACTIONS)}")
+        unknown = [name for name in self.params or {} if name not in ACTION_PARAMS]
+        if unknown:
+            raise ValueError(
+                f"Unknown parameter(s): {', '.join(unknown)}. Must be among {', '.join(ACTION_PARAMS)}"
+            )
+
+    def describe_target(self) -> str:
+        """Short description of the selector."""
+        if self.device_id:
+            return self.device_id
+        filter_desc = []
+        if self.room:
+            filter_desc.append(f"room={self.room}")
+        if self.device_type:
+            filter_desc.append(f"type={self.device_type}")
+        return ", ".join(filter_desc) or "all devices"
+
+    def not_found(self) -> str:
+        """Error message for a selector that matched no device."""
+        if self.device_id:
+            return f"Device '{self.device_id}' not found."
+        return f"No devices found matching: {self.describe_target()}"
+
+
+def apply_action(
+    device: Dict[str, Any],
+    action: str,
+    brightness: Optional[int] = None,
+    position: Optional[int] = None,
+    speed: Optional[int] = None,
+    target_temp: Optional[int] = None,
+    mode: Optional[str] = None
+) -> Tuple[Optional[str], Dict[str, Any]]:
+    """
+    Work out what an action does to a device.
+
+    Returns the new state (None when the action does not set one) and a new
+    properties dict; the device itself is not modified. Actions that do not
+    apply to the device type leave both unchanged.
+    """
+    dev_type = device["type"]
+    current_state = device["state"]
+    properties = device.get("properties") or {}
+
+    new_state = None
+    new_properties = properties.copy()
+
+    if action in ["on", "off"]:
+        if dev_type in ["light", "fan", "sprinkler", "ev_charger"]:
+            new_state = action
+            if dev_type == "light" and brightness is not None:
+                new_properties["brightness"] = max(0, min(100, brightness))
+            elif dev_type == "light" and action == "on" and new_properties.get("brightness", 0) == 0:
+                new_properties["brightness"] = 100
+            elif dev_type == "light" and action == "off":
+                new_properties["brightness"] = 0
+            elif dev_type == "fan" and speed is not None:
+                new_properties["speed"] = max(0, min(3, speed))
+
+    elif action in ["open", "close"]:
+        if dev_type in ["blinds", "garage"]:
+            new_state = action
+            if dev_type == "blinds":
+                new_properties["position"] = 100 if action == "open" else 0
+                if position is not None:
+                    new_properties["position"] = max(0, min(100, position))
+                    new_state = "open" if position > 0 else "closed"
+
+    elif action in ["lock", "unlock"]:
+        if dev_type == "lock":
+            new_state = "locked" if action == "lock" else "unlocked"
+
+    elif action == "set":
+        if dev_type == "light" and brightness is not None:
+            new_state = "on" if brightness > 0 else "off"
+            new_properties["brightness"] = max(0, min(100, brightness))
+        elif dev_type == "blinds" and position is not None:
+            new_properties["position"] = max(0, min(100, position))
+            new_state = "open" if position > 0 else "closed"
+        elif dev_type == "fan" and speed is not None:
+            new_properties["speed"] = max(0, min(3, speed))
+            new_state = "on" if speed > 0 else "off"
+        elif dev_type == "thermostat":
+            if target_temp is not None:
+                new_properties["target_temp"] = target_temp
+            if mode is not None:
+                new_properties["mode"] = mode
+                new_state = mode
+
+    elif action == "toggle":
+        if dev_type in ["light", "fan"]:
+            new_state = "off" if current_state == "on" else "on"
+            if dev_type == "light":
+                new_properties["brightness"] = 100 if new_state == "on" else 0
+        elif dev_type in ["blinds", "garage"]:
+            new_state = "closed" if current_state == "open" else "open"
+            if dev_type == "blinds":
+                new_properties["position"] = 0 if new_state == "closed" else 100
+        elif dev_type == "lock":
+            new_state = "unlocked" if current_state == "locked" else "locked"
+
+    return new_state, new_properties
+
+
+def describe_change(change: Dict[str, Any]) -> str:
+    """One result line for a device change returned by ``Database.execute_commands``."""
+    if not change["changed"]:
+        return f"ℹ️ {change['device_id']}: No change needed (already {change['previous_state']})"
+
+    message = f"✅ {change['device_id']}: {change['previous_state']} → {change['state']}"
+    properties = change["properties"]
+    if change["device_type"] == "light" and "brightness" in properties:
+        message += f" (brightness: {properties['brightness']}%)"
+    elif change["device_type"] == "thermostat" and "target_temp" in properties:
+        message += f" (target: {properties['target_temp']}°F)"
+    return message
+
+
+def describe_result(result: Dict[str, Any]) -> List[str]:
+    """Result lines for one command (an error line when it failed)."""
+    if result["error"]:
+        return [f"❌ {result['error']}"]
+    return [describe_change(change) for change in result["devices"]]
@@ -0,0 +1,119 @@
+"""Buffered, group-committed writer for the events audit log."""
+import asyncio
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from app.config import config
+
+
+# (event_type, device_id, action, metadata_json, timestamp)
+EventInsertRow = Tuple[str, Optional[str], Optional[str], Optional[str], str]
+
+
+class EventLogWriter:
+    """
+    Queues audit events in memory and flushes them in batches.
+
+    Events are written with one executemany inside a single transaction once
+    ``batch_size`` events are pending or ``flush_interval`` seconds have
+    passed, so tool latency does not depend on audit logging.
+    """
+
+    def __init__(
+        self,
+        database,
+        batch_size: int = config.EVENT_LOG_BATCH_SIZE,
+        flush_interval: float = config.EVENT_LOG_FLUSH_INTERVAL
+    ):
+        self._db = database
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffer: List[EventInsertRow] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+
+        # Metrics
+        self._flush_count = 0
+        self._events_flushed = 0
+        self._last_flush_ms = 0.0
+        self._max_flush_ms = 0.0
+        self._total_flush_ms = 0.0
+
+    @property
+    def running(self) -> bool:
+        """Whether the background flusher is active."""
+        return self._task is not None
+
+    def start(self):
+        """Start the background flush loop."""
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the flush loop and write out any pending events."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def enqueue(self, rows: List[EventInsertRow]):
+        """Queue events for the next batch."""
+        self._buffer.extend(rows)
+        if len(self._buffer) >= self.batch_size and self._wakeup:
+            self._wakeup.set()
+
+    async def flush(self):
+        """Write all pending events in a single transaction."""
+        async with self._flush_lock:
+            if not self._buffer:
+                return
+
+            rows, self._buffer = self._buffer, []
+            start = time.perf_counter()
+            try:
+                await self._db.insert_events(rows)
+            except BaseException:
+                # Keep the events for the next attempt
+                self._buffer[:0] = rows
+                raise
+
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            self._flush_count += 1
+            self._events_flushed += len(rows)
+            self._last_flush_ms = elapsed_ms
+            self._max_flush_ms = max(self._max_flush_ms, elapsed_ms)
+            self._total_flush_ms += elapsed_ms
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Flush counters and latency metrics."""
+        return {
+            "pending": len(self._buffer),
+            "flushes": self._flush_count,
+            "events_flushed": self._events_flushed,
+            "last_flush_ms": round(self._last_flush_ms, 3),
+            "max_flush_ms": round(self._max_flush_ms, 3),
+            "avg_flush_ms": round(
+                self._total_flush_ms / self._flush_count, 3
+            ) if self._flush_count else 0.0
+        }
+
+    async def _run(self):
+        """Flush whenever the batch fills up or the interval elapses."""
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            try:
+                await self.flush()
+            except Exception as e:
+                # stdout carries the MCP stdio protocol
+                print(f"Error flushing event log: {e}", file=sys.stderr)
@@ -0,0 +1,281 @@
+"""Day-partitioned event storage with per-type retention and hourly rollups."""
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional
+from app.config import config
+
+
+PARTITION_PREFIX = "events_p"
+LEGACY_PARTITION = "events_legacy"
+
+EVENT_COLUMNS = "id, event_type, device_id, action, metadata, timestamp"
+
+# The events view is one compound SELECT per partition, and SQLite allows at
+# most 500 terms in a compound SELECT (SQLITE_MAX_COMPOUND_SELECT)
+MAX_VIEW_PARTITIONS = 500
+
+PARTITION_DDL = [
+    """CREATE TABLE IF NOT EXISTS {name} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        event_type TEXT NOT NULL,
+        device_id TEXT,
+        action TEXT,
+        metadata TEXT,  -- JSON string
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (device_id) REFERENCES devices(id)
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_{name}_device_ts ON {name}(device_id, timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_{name}_type_ts ON {name}(event_type, timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_{name}_timestamp ON {name}(timestamp)",
+]
+
+# Indexes superseded by the composite ones above
+OBSOLETE_INDEXES = [
+    "idx_{name}_device_id",
+    "idx_events_device_id",
+]
+
+
+def partition_day(timestamp: str) -> str:
+    """Day (YYYY-MM-DD) an event timestamp belongs to."""
+    return timestamp[:10]
+
+
+def partition_name(day: str) -> str:
+    """Partition table name for a day, e.g. events_p20240101."""
+    return f"{PARTITION_PREFIX}{day.replace('-', '')}"
+
+
+async def rebuild_events_view(conn):
+    """
+    Recreate the ``events`` view as a UNION ALL over all partitions.
+
+    Only the newest MAX_VIEW_PARTITIONS partitions fit in the view; older
+    ones (e.g. kept from a longer retention) are still read by
+    ``Database.query_events``, which queries partitions directly.
+    """
+    async with conn.execute(
+        "SELECT name FROM event_partitions ORDER BY day DESC LIMIT ?",
+        (MAX_VIEW_PARTITIONS,)
+    ) as cursor:
+        names = [row[0] for row in await cursor.fetchall()][::-1]
+
+    if names:
+        body = " UNION ALL ".join(f"SELECT {EVENT_COLUMNS} FROM {name}" for name in names)
+    else:
+        body = (
+            "SELECT NULL AS id, NULL AS event_type, NULL AS device_id, "
+            "NULL AS action, NULL AS metadata, NULL AS timestamp WHERE 0"
+        )
+
+    await conn.execute("DROP VIEW IF EXISTS events")
+    await conn.execute(f"CREATE VIEW events AS {body}")
+
+
+async def create_partition(conn, day: str) -> str:
+    """
+    Create the partition for a day if it does not exist yet.
+
+    Must run inside a write transaction. Event ids come from the shared
+    ``event_sequence`` (see ``reserve_event_ids``), not from the partition.
+    """
+    name = partition_name(day)
+    for statement in PARTITION_DDL:
+        await conn.execute(statement.format(name=name))
+
+    cursor = await conn.execute(
+        "INSERT OR IGNORE INTO event_partitions (name, day) VALUES (?, ?)",
+        (name, day)
+    )
+    if cursor.rowcount > 0:
+        await rebuild_events_view(conn)
+    return name
+
+
+async def ensure_event_sequence(conn):
+    """
+    Create the shared event id sequence, starting after every existing id.
+
+    Must run inside a write transaction.
+    """
+    async with conn.execute("SELECT seq FROM event_sequence WHERE id = 0") as cursor:
+        if await cursor.fetchone():
+            return
+
+    async with conn.execute("SELECT name FROM event_partitions") as cursor:
+        names = [row[0] for row in await cursor.fetchall()]
+
+    seq = 0
+    for name in names:
+        async with conn.execute(f"SELECT MAX(id) FROM {name}") as cursor:
+            seq = max(seq, (await cursor.fetchone())[0] or 0)
+    await conn.execute("INSERT INTO event_sequence (id, seq) VALUES (0, ?)", (seq,))
+
+
+async def reserve_event_ids(conn, count: int) -> int:
+    """
+    Reserve ``count`` consecutive event ids and return the first.
+
+    Must run inside a write transaction, which serializes writers across
+    processes, so ids are unique across partitions: a late flush into an
+    older day's partition can no longer reuse ids of a newer one.
+    """
+    async with conn.execute(
+        "UPDATE event_sequence SET seq = seq + ? WHERE id = 0 RETURNING seq", (count,)
+    ) as cursor:
+        last = (await cursor.fetchone())[0]
+    return last - count + 1
+
+
+async def migrate_legacy_events(conn):
+    """
+    Convert a pre-partitioning ``events`` table into a partition.
+
+    The old table is renamed and registered under the day of its newest
+    event, so it is rolled up and dropped like any other partition.
+    """
+    async with conn.execute(
+        "SELECT type FROM sqlite_master WHERE name = 'events'"
+    ) as cursor:
+        row = await cursor.fetchone()
+
+    if row and row[0] == "table":
+        async with conn.execute("SELECT MAX(timestamp) FROM events") as cursor:
+            newest = (await cursor.fetchone())[0]
+
+        if newest is None:
+            await conn.execute("DROP TABLE events")
+        else:
+            await conn.execute(f"ALTER TABLE events RENAME TO {LEGACY_PARTITION}")
+            await conn.execute(
+                "INSERT OR IGNORE INTO event_partitions (name, day) VALUES (?, ?)",
+                (LEGACY_PARTITION, partition_day(str(newest)))
+            )
+        row = None
+
+    if row is None:
+        await rebuild_events_view(conn)
+
+    await ensure_partition_indexes(conn)
+
+
+async def ensure_partition_indexes(conn):
+    """Bring the indexes of existing partitions up to date."""
+    async with conn.execute("SELECT name FROM event_partitions") as cursor:
+        names = [row[0] for row in await cursor.fetchall()]
+
+    for name in names:
+        for statement in PARTITION_DDL[1:]:
+            await conn.execute(statement.format(name=name))
+        for index in OBSOLETE_INDEXES:
+            await conn.execute(f"DROP INDEX IF EXISTS {index.format(name=name)}")
+
+
+class EventRetention:
+    """
+    Background maintenance for partitioned events.
+
+    Each run rolls closed days up into hourly ``event_rollups`` rows, deletes
+    event types whose retention is shorter than the partition's age, drops
+    partitions older than the longest retention with ``DROP TABLE`` and
+    trims expired rollups.
+    """
+
+    def __init__(
+        self,
+        default_days: int = config.EVENT_RETENTION_DEFAULT_DAYS,
+        days_by_type: Optional[Dict[str, int]] = None,
+        rollup_days: int = config.EVENT_ROLLUP_RETENTION_DAYS
+    ):
+        self.default_days = default_days
+        self.days_by_type = dict(
+            config.EVENT_RETENTION_DAYS if days_by_type is None else days_by_type
+        )
+        self.rollup_days = rollup_days
+
+        # Today's partition, the retained days and a legacy partition must
+        # all fit in the events view
+        if self.max_days + 2 > MAX_VIEW_PARTITIONS:
+            raise ValueError(
+                f"Event retention of {self.max_days} days exceeds the "
+                f"{MAX_VIEW_PARTITIONS - 2} day maximum"
+            )
+
+    @property
+    def max_days(self) -> int:
+        """Longest retention of any event type."""
+        return max([self.default_days, *self.days_by_type.values()])
+
+    async def run(self, db, today: Optional[date] = None) -> Dict[str, Any]:
+        """Run one maintenance pass and return what was done."""
+        today = today or date.today()
+        summary = {"rolled_up": [], "pruned": [], "dropped": []}
+
+        async with db.reader() as conn:
+            async with conn.execute(
+                "SELECT name, day, rolled_up FROM event_partitions ORDER BY day"
+            ) as cursor:
+                partitions = [tuple(row) for row in await cursor.fetchall()]
+
+        for name, day, rolled_up in partitions:
+            age = (today - date.fromisoformat(day)).days
+
+            # One transaction per partition keeps the write lock short
+            async with db.transaction() as conn:
+                if age > 0 and not rolled_up:
+                    await self._rollup(conn, name)
+                    summary["rolled_up"].append(name)
+
+                if age > self.max_days:
+                    await conn.execute(f"DROP TABLE IF EXISTS {name}")
+                    await conn.execute("DELETE FROM event_partitions WHERE name = ?", (name,))
+                    await rebuild_events_view(conn)
+                    summary["dropped"].append(name)
+                elif await self._prune(conn, name, age):
+                    summary["pruned"].append(name)
+
+        cutoff = (today - timedelta(days=self.rollup_days)).isoformat()
+        async with db.transaction() as conn:
+            await conn.execute("DELETE FROM event_rollups WHERE hour < ?", (cutoff,))
+
+        return summary
+
+    async def _rollup(self, conn, name: str):
+        """Summarize a partition into hourly counts."""
+        await conn.execute(
+            f"""INSERT INTO event_rollups (hour, event_type, device_id, action, count)
+                SELECT replace(substr(timestamp, 1, 13), ' ', 'T'), event_type,
+                       COALESCE(device_id, ''), COALESCE(action, ''), COUNT(*)
+                FROM {name}
+                WHERE true
+                GROUP BY 1, 2, 3, 4
+                ON CONFLICT (hour, event_type, device_id, action)
+                DO UPDATE SET count = count + excluded.count"""
+        )
+        await conn.execute(
+            "UPDATE event_partitions SET rolled_up = 1 WHERE name = ?", (name,)
+        )
+
+    async def _prune(self, conn, name: str, age: int) -> bool:
+        """Delete event types whose retention has expired within a partition."""
+        expired = [t for t, days in self.days_by_type.items() if age > days]
+        conditions = []
+        params: List[Any] = []
+
+        if expired:
+            conditions.append(f"event_type IN ({', '.join('?' * len(expired))})")
+            params.extend(expired)
+        if age > self.default_days:
+            if self.days_by_type:
+                explicit = list(self.days_by_type)
+                conditions.append(f"event_type NOT IN ({', '.join('?' * len(explicit))})")
+                params.extend(explicit)
+            else:
+                conditions.append("1")
+
+        if not conditions:
+            return False
+
+        cursor = await conn.execute(
+            f"DELETE FROM {name} WHERE {' OR '.join(conditions)}", params
+        )
+        return cursor.rowcount > 0
@@ -0,0 +1,144 @@
+"""Declarative home mode scenes compiled to set-based SQL updates."""
+from typing import Any, Dict, List, Optional, Tuple
+from app.utils import codec
+
+
+# Each rule targets devices of one type (optionally narrowed by an ID
+# substring) and declares the state and/or properties they should end up with.
+# Properties are merged over the stored ones, so scene values always win.
+HOME_MODE_SCENES: Dict[str, List[Dict[str, Any]]] = {
+    "home": [
+        {
+            "type": "light",
+            "id_contains": "main",
+            "state": "on",
+            "properties": {"brightness": 75},
+            "label": "💡 {id}: ON (75%)"
+        },
+        {
+            "type": "thermostat",
+            "state": "auto",
+            "properties": {"target_temp": 72, "mode": "auto"},
+            "label": "🌡️ Thermostat: 72°F (auto)"
+        },
+    ],
+    "away": [
+        {
+            "type": "light",
+            "state": "off",
+            "properties": {"brightness": 0},
+            "label": "💡 {id}: OFF"
+        },
+        {"type": "lock", "state": "locked", "label": "🔒 {id}: LOCKED"},
+        {
+            "type": "thermostat",
+            "properties": {"target_temp": 65},
+            "label": "🌡️ Thermostat: 65°F"
+        },
+    ],
+    "sleep": [
+        {
+            "type": "light",
+            "id_contains": "bedroom",
+            "state": "on",
+            "properties": {"brightness": 20},
+            "label": "💡 {id}: DIM (20%)"
+        },
+        {
+            "type": "light",
+            "id_excludes": "bedroom",
+            "state": "off",
+            "properties": {"brightness": 0},
+            "label": "💡 {id}: OFF"
+        },
+        {"type": "lock", "state": "locked", "label": "🔒 {id}: LOCKED"},
+        {
+            "type": "thermostat",
+            "properties": {"target_temp": 68},
+            "label": "🌡️ Thermostat: 68°F"
+        },
+    ],
+    "vacation": [
+        {
+            "type": "light",
+            "state": "off",
+            "properties": {"brightness": 0},
+            "label": "💡 {id}: OFF"
+        },
+        {"type": "lock", "state": "locked", "label": "🔒 {id}: LOCKED"},
+        {"type": "garage", "state": "closed", "label": "🚗 Garage: CLOSED"},
+        {
+            "type": "thermostat",
+            "properties": {"target_temp": 60},
+            "label": "🌡️ Thermostat: 60°F"
+        },
+    ],
+}
+
+
+class SceneStatement:
+    """A single compiled scene rule: one UPDATE touching only rows that differ."""
+
+    def __init__(self, rule: Dict[str, Any]):
+        self.label: str = rule.get("label", "{id}")
+
+        state: Optional[str] = rule.get("state")
+        properties: Dict[str, Any] = rule.get("properties") or {}
+
+        set_clauses = []
+        self._set_params: List[Any] = []
+        if state is not None:
+            set_clauses.append("state = ?")
+            self._set_params.append(state)
+        if properties:
+            set_clauses.append("properties = json_patch(COALESCE(properties, '{}'), ?)")
+            self._set_params.append(codec.dumps(properties))
+        set_clauses.append("last_updated = ?")
+
+        where_clauses = ["type = ?"]
+        self._where_params: List[Any] = [rule["type"]]
+        if rule.get("id_contains"):
+            where_clauses.append("instr(id, ?) > 0")
+            self._where_params.append(rule["id_contains"])
+        if rule.get("id_excludes"):
+            where_clauses.append("instr(id, ?) = 0")
+            self._where_params.append(rule["id_excludes"])
+
+        # Diff predicate: skip rows already in the target state
+        diff_clauses = []
+        if state is not None:
+            diff_clauses.append("state IS NOT ?")
+            self._where_params.append(state)
+        for key, value in properties.items():
+            diff_clauses.append(f"json_extract(properties, '$.{key}') IS NOT ?")
+            self._where_params.append(value)
+        if diff_clauses:
+            where_clauses.append(f"({' OR '.join(diff_clauses)})")
+
+        self.sql = (
+            f"UPDATE devices SET {', '.join(set_clauses)} "
+            f"WHERE {' AND '.join(where_clauses)} "
+            "RETURNING id, type, room, state, properties, last_updated"
+        )
+
+    def params(self, timestamp: str) -> Tuple[Any, ...]:
+        """Bind parameters for execution at the given timestamp."""
+        return (*self._set_params, timestamp, *self._where_params)
+
+    def describe(self, device: Dict[str, Any]) -> str:
+        """Human readable description of the change applied to a device."""
+        return self.label.format(id=device["id"])
+
+
+class CompiledScene:
+    """A home mode compiled once into a handful of set-based statements."""
+
+    def __init__(self, mode: str, rules: List[Dict[str, Any]]):
+        self.mode = mode
+        self.statements = [SceneStatement(rule) for rule in rules]
+
+
+# Scenes are compiled once at import time
+SCENES: Dict[str, CompiledScene] = {
+    mode: CompiledScene(mode, rules) for mode, rules in HOME_MODE_SCENES.items()
+}
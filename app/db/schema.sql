@@ -10,15 +10,30 @@ CREATE TABLE IF NOT EXISTS devices (
     last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
--- Events table: logs all device actions and events
-CREATE TABLE IF NOT EXISTS events (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
+-- Events: logs all device actions and events. Rows live in one table per
+-- day (events_pYYYYMMDD, see app/db/event_store.py) registered here; the
+-- "events" view is a UNION ALL over all registered partitions.
+CREATE TABLE IF NOT EXISTS event_partitions (
+    name TEXT PRIMARY KEY,
+    day TEXT NOT NULL,  -- YYYY-MM-DD covered by the partition
+    rolled_up BOOLEAN DEFAULT 0
+);
+
+-- Event id sequence: one row (id 0) holding the last event id handed out,
+-- shared by all partitions so ids are unique across them
+CREATE TABLE IF NOT EXISTS event_sequence (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    seq INTEGER NOT NULL
+);
+
+-- Event rollups: hourly event counts kept after raw events expire
+CREATE TABLE IF NOT EXISTS event_rollups (
+    hour TEXT NOT NULL,  -- YYYY-MM-DDTHH
     event_type TEXT NOT NULL,
-    device_id TEXT,
-    action TEXT,
-    metadata TEXT,  -- JSON string
-    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (device_id) REFERENCES devices(id)
+    device_id TEXT NOT NULL DEFAULT '',
+    action TEXT NOT NULL DEFAULT '',
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (hour, event_type, device_id, action)
 );
 
 -- Home modes table: tracks home automation modes
@@ -38,6 +53,73 @@ CREATE TABLE IF NOT EXISTS automations (
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Device counters: per (type, state) device counts maintained by triggers
+CREATE TABLE IF NOT EXISTS device_counters (
+    type TEXT NOT NULL,
+    state TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (type, state)
+);
+
+CREATE TRIGGER IF NOT EXISTS trg_device_counters_insert
+AFTER INSERT ON devices
+BEGIN
+    INSERT INTO device_counters (type, state, count) VALUES (NEW.type, NEW.state, 1)
+    ON CONFLICT (type, state) DO UPDATE SET count = count + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_device_counters_delete
+AFTER DELETE ON devices
+BEGIN
+    UPDATE device_counters SET count = count - 1
+    WHERE type = OLD.type AND state = OLD.state;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_device_counters_update
+AFTER UPDATE OF type, state ON devices
+WHEN OLD.type IS NOT NEW.type OR OLD.state IS NOT NEW.state
+BEGIN
+    UPDATE device_counters SET count = count - 1
+    WHERE type = OLD.type AND state = OLD.state;
+    INSERT INTO device_counters (type, state, count) VALUES (NEW.type, NEW.state, 1)
+    ON CONFLICT (type, state) DO UPDATE SET count = count + 1;
+END;
+
+-- Changes table: change data capture log appended by triggers on devices
+-- and home_modes. Consumers remember the last seq they processed and read
+-- newer rows with a primary key range scan.
+CREATE TABLE IF NOT EXISTS changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    device_id TEXT,    -- device ID, or the mode name for op = 'mode'
+    op TEXT NOT NULL,  -- insert, update, delete, mode
+    changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TRIGGER IF NOT EXISTS trg_changes_device_insert
+AFTER INSERT ON devices
+BEGIN
+    INSERT INTO changes (device_id, op) VALUES (NEW.id, 'insert');
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_changes_device_update
+AFTER UPDATE ON devices
+BEGIN
+    INSERT INTO changes (device_id, op) VALUES (NEW.id, 'update');
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_changes_device_delete
+AFTER DELETE ON devices
+BEGIN
+    INSERT INTO changes (device_id, op) VALUES (OLD.id, 'delete');
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_changes_mode
+AFTER UPDATE OF is_active ON home_modes
+WHEN NEW.is_active = 1
+BEGIN
+    INSERT INTO changes (device_id, op) VALUES (NEW.mode, 'mode');
+END;
+
 -- Initialize home modes
 INSERT OR IGNORE INTO home_modes (mode, is_active) VALUES 
     ('home', 1),
@@ -46,9 +128,10 @@ INSERT OR IGNORE INTO home_modes (mode, is_active) VALUES
     ('vacation', 0);
 
 -- Create indexes for common queries
-CREATE INDEX IF NOT EXISTS idx_devices_room ON devices(room);
-CREATE INDEX IF NOT EXISTS idx_devices_type ON devices(type);
+-- (room, id) and (type, id) also serve keyset pages in ID order
+DROP INDEX IF EXISTS idx_devices_room;
+DROP INDEX IF EXISTS idx_devices_type;
+CREATE INDEX IF NOT EXISTS idx_devices_room_id ON devices(room, id);
+CREATE INDEX IF NOT EXISTS idx_devices_type_id ON devices(type, id);
 CREATE INDEX IF NOT EXISTS idx_devices_state ON devices(state);
-CREATE INDEX IF NOT EXISTS idx_events_device_id ON events(device_id);
-CREATE INDEX IF NOT EXISTS idx_events_timestamp ON events(timestamp);
 
@@ -221,5 +221,6 @@ async def seed_database(db):
         )
     
     await db._connection.commit()
+    db.invalidate_registry()
     print(f"Successfully seeded {len(SEED_DEVICES)} devices.")
 
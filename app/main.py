@@ -3,18 +3,28 @@ import asyncio
 import sys
 from pathlib import Path
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from typing import Optional
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import StreamingResponse
+from typing import Any, Dict, List, Optional
 
 # Add parent directory to path for imports
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
 from app.config import config
 from app.db.database import db
+from app.db.event_store import EventRetention
 from app.db.seed_data import seed_database
-from app.schemas.responses import StatsResponse
-from app.utils.websocket_manager import ws_manager
+from app.models.device import DeviceCommandRequest
+from app.schemas.responses import CommandsResponse, EventsResponse, SnapshotResponse, StatsResponse
+from app.utils.broadcast_bus import broadcast_bus
+from app.utils.change_notify import ChangePublisher, start_change_listener
+from app.utils.codec import FrameFormat, JSONResponse
+from app.utils import codec
+from app.utils.file_lock import FileLock
+from app.utils.response_cache import response_cache
+from app.utils.websocket_manager import Subscription, ws_manager
 
 
 @asynccontextmanager
@@ -23,30 +33,85 @@ async def lifespan(app: FastAPI):
     # Startup
     print("Starting home automation server...")
     await db.connect()
-    await db.initialize_schema()
-    await seed_database(db)
+    # With several workers only one at a time may create the schema and seed
+    startup_lock = FileLock(config.STARTUP_LOCK_PATH)
+    await asyncio.to_thread(startup_lock.acquire, True)
+    try:
+        await db.initialize_schema()
+        await seed_database(db)
+    finally:
+        startup_lock.release()
     print(f"Database initialized at: {config.DATABASE_PATH}")
+    db.event_log.start()
     
-    # Start background task for database polling
-    polling_task = asyncio.create_task(poll_database_changes())
+    # Join the broadcast bus; the elected worker runs change detection
+    await broadcast_bus.start(dispatch_change, start_change_detection)
     
     yield
     
     # Shutdown
     print("Shutting down home automation server...")
-    polling_task.cancel()
-    try:
-        await polling_task
-    except asyncio.CancelledError:
-        pass
+    await broadcast_bus.stop()
+    if leader_resources.get("notify_transport"):
+        leader_resources["notify_transport"].close()
+    for task in leader_resources.get("tasks", []):
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    leader_resources.clear()
+    change_publisher.close()
+    await db.event_log.stop()
     await db.disconnect()
 
 
+# Change notification listener and background tasks of the leader worker
+leader_resources: Dict[str, Any] = {}
+
+
+async def start_change_detection():
+    """Start change detection and maintenance (on the leader worker only)."""
+    # Listen for change notifications pushed by the MCP server
+    try:
+        leader_resources["notify_transport"] = await start_change_listener(
+            lambda message: changes_pending.set()
+        )
+        print(f"Listening for change notifications on udp://{config.CHANGE_NOTIFY_HOST}:{config.CHANGE_NOTIFY_PORT}")
+    except OSError as e:
+        print(f"Change notifications unavailable ({e}), relying on polling")
+    
+    # Start background tasks for change polling and maintenance
+    leader_resources["tasks"] = [
+        asyncio.create_task(poll_database_changes()),
+        asyncio.create_task(run_maintenance(EventRetention()))
+    ]
+
+
+async def dispatch_change(event: Dict[str, Any]):
+    """Apply a change event from the broadcast bus to this worker's clients."""
+    # Every event carries the latest change seq (None after missed events)
+    response_cache.set_version(event.get("seq"))
+    
+    kind = event.get("event")
+    if kind == "delta":
+        await ws_manager.broadcast_devices_delta(
+            event["devices"], event["deleted"], event["stats"], event["seq"]
+        )
+    elif kind == "mode":
+        await ws_manager.broadcast_mode_change(event["mode"], event["stats"], event["seq"])
+    elif kind == "full_refresh":
+        await ws_manager.broadcast_full_refresh(event["seq"])
+    elif kind == "reset":
+        ws_manager.reset_replay(event["seq"])
+
+
 app = FastAPI(
     title="Home Automation API",
     description="REST API and WebSocket server for home automation control",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=JSONResponse
 )
 
 # Add CORS middleware
@@ -56,55 +121,96 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
 
+# Compress larger responses (including streamed ones) for clients that accept gzip
+app.add_middleware(GZipMiddleware, minimum_size=config.GZIP_MIN_SIZE)
+
+
+# Set when a change notification arrives (or a local write happens)
+changes_pending = asyncio.Event()
+
+# Notifies the leader worker about writes made by this worker
+change_publisher = ChangePublisher()
 
-# Background task to poll for database changes
+
+def notify_local_write(seq: int):
+    """Wake the change feed after this worker committed a write up to ``seq``."""
+    if broadcast_bus.is_leader:
+        changes_pending.set()
+    else:
+        # The leader runs the change feed; tell it the way the MCP server does
+        change_publisher.publish(seq)
+
+
+# Background task to read database changes
 async def poll_database_changes():
-    """Poll database for changes and broadcast to WebSocket clients."""
-    last_update_time = None
-    last_mode = None
+    """
+    Read the changes table and broadcast to WebSocket clients.
+    
+    Triggers on devices and home_modes append a row with a monotonic seq to
+    the changes table for every write, so each read is a primary key range
+    scan over new rows only. Clients receive the changed device rows plus
+    updated stats (``devices_delta``), so the work per change is proportional
+    to the devices that changed, not to clients x devices. Reads run as soon
+    as a change notification arrives; polling every UPDATE_CHECK_INTERVAL is
+    only a fallback.
+    
+    Runs on the leader worker only and publishes to the broadcast bus; every
+    worker (this one included) applies the events to its own clients.
+    """
+    last_seq = await db.get_change_seq()
+    await broadcast_bus.publish({"event": "reset", "seq": last_seq})
     
-    print("Starting database change polling (checks every 100ms)...")
+    print(f"Starting database change feed (fallback poll every {config.UPDATE_CHECK_INTERVAL}s)...")
     
     while True:
         try:
-            await asyncio.sleep(config.UPDATE_CHECK_INTERVAL)
+            try:
+                await asyncio.wait_for(changes_pending.wait(), timeout=config.UPDATE_CHECK_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            changes_pending.clear()
             
-            # Check if there are any WebSocket connections
-            if not ws_manager.active_connections:
+            # Without WebSocket connections there is nobody to notify; skip ahead
+            # (other workers' clients are unknown here, so only for a local bus)
+            if broadcast_bus.is_local and not ws_manager.active_connections:
+                last_seq = await db.get_change_seq()
+                await broadcast_bus.publish({"event": "reset", "seq": last_seq})
                 continue
             
-            # Get the most recent update time from devices table
-            async with db._connection.execute(
-                "SELECT MAX(last_updated) as max_time FROM devices"
-            ) as cursor:
-                row = await cursor.fetchone()
-                current_update_time = row[0] if row else None
+            delta = await db.get_changes_delta(last_seq)
+            if delta is None:
+                continue
+            last_seq = delta["seq"]
             
-            # Check for home mode changes
-            current_mode = await db.get_active_mode()
+            # Too far behind for a delta; clients re-fetch everything
+            if not delta["complete"]:
+                print("📡 Change backlog too large, sending full refresh...")
+                await broadcast_bus.publish({"event": "full_refresh", "seq": delta["seq"]})
+                continue
             
-            # If database has been updated, broadcast changes
-            if last_update_time is not None and current_update_time != last_update_time:
-                print(f"📡 Database change detected! Broadcasting to {len(ws_manager.active_connections)} clients...")
-                
-                # Broadcast full refresh to all clients
-                await ws_manager.broadcast_full_refresh()
-                
-                # Update last known time
-                last_update_time = current_update_time
-            elif last_update_time is None:
-                # First run - just store the timestamp
-                last_update_time = current_update_time
+            # If devices changed, broadcast just the changed rows
+            if delta["devices"] or delta["deleted"]:
+                print(f"📡 {len(delta['devices']) + len(delta['deleted'])} device change(s) detected! Broadcasting...")
+                await broadcast_bus.publish({
+                    "event": "delta",
+                    "devices": delta["devices"],
+                    "deleted": delta["deleted"],
+                    "stats": delta["stats"],
+                    "seq": delta["seq"]
+                })
             
             # Check for mode changes
-            if last_mode is not None and current_mode != last_mode:
-                print(f"🏠 Home mode changed to: {current_mode}")
-                await ws_manager.broadcast_mode_change(current_mode)
-                last_mode = current_mode
-            elif last_mode is None:
-                last_mode = current_mode
+            if delta["mode"]:
+                print(f"🏠 Home mode changed to: {delta['mode']}")
+                await broadcast_bus.publish({
+                    "event": "mode",
+                    "mode": delta["mode"],
+                    "stats": delta["stats"],
+                    "seq": delta["seq"]
+                })
                     
         except asyncio.CancelledError:
             print("Stopping database polling...")
@@ -115,6 +221,25 @@ async def poll_database_changes():
             traceback.print_exc()
 
 
+# Background task for event retention and change log compaction
+async def run_maintenance(retention: EventRetention):
+    """Periodically roll up, prune and drop old event partitions and compact changes."""
+    while True:
+        try:
+            summary = await retention.run(db)
+            if any(summary.values()):
+                print(f"🧹 Event maintenance: {summary}")
+            compacted = await db.compact_changes()
+            if compacted:
+                print(f"🧹 Compacted {compacted} change rows")
+            await asyncio.sleep(config.EVENT_MAINTENANCE_INTERVAL)
+        except asyncio.CancelledError:
+            break
+        except Exception as e:
+            print(f"Error in maintenance: {e}")
+            await asyncio.sleep(config.EVENT_MAINTENANCE_INTERVAL)
+
+
 @app.get("/")
 async def root():
     """Root endpoint."""
@@ -125,55 +250,301 @@ async def root():
             "devices": "/api/devices",
             "rooms": "/api/rooms",
             "stats": "/api/stats",
+            "snapshot": "/api/snapshot",
+            "events": "/api/events",
+            "commands": "POST /api/commands",
+            "metrics": "/api/metrics",
             "websocket": "/ws"
         }
     }
 
 
+# /api/devices, /api/rooms, /api/stats and /api/snapshot answer with an ETag
+# of the data version; a matching If-None-Match gets 304 without touching SQLite
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+async def stream_devices(devices):
+    """Encode streamed devices as NDJSON, one chunk per database batch."""
+    lines = []
+    try:
+        async for device in devices:
+            lines.append(codec.dumps_bytes(device))
+            if len(lines) >= config.DEVICE_STREAM_BATCH:
+                yield b"\n".join(lines) + b"\n"
+                lines = []
+        if lines:
+            yield b"\n".join(lines) + b"\n"
+    finally:
+        # Stop the device iterator even if the client went away
+        await devices.aclose()
+
+
 @app.get("/api/devices")
-async def get_devices(room: Optional[str] = None, type: Optional[str] = None):
-    """Get all devices with optional filters."""
-    devices = await db.get_devices(room=room, device_type=type)
-    return devices
+async def get_devices(
+    request: Request,
+    room: Optional[str] = None,
+    type: Optional[str] = None,
+    after_id: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=config.DEVICE_PAGE_MAX),
+    fields: Optional[str] = None,
+    format: Optional[str] = None
+):
+    """
+    Get all devices with optional filters.
+
+    - ``limit``/``after_id``: one page in ID order as ``{"devices",
+      "next_after_id"}``; pass ``next_after_id`` as ``after_id`` for the next
+    - ``fields=id,state``: only these columns (``id`` is always included)
+    - ``format=ndjson`` (or ``Accept: application/x-ndjson``): stream one
+      device per line, in ID order, read from the database in batches
+    """
+    field_list = [f.strip() for f in fields.split(",") if f.strip()] if fields else None
+    try:
+        columns = db.device_fields(field_list)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if format not in (None, "json", "ndjson"):
+        raise HTTPException(status_code=400, detail="Invalid format. Must be one of: json, ndjson")
+
+    stream = format == "ndjson" or (
+        format is None and NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+    )
+    if stream:
+        _, headers, not_modified = await response_cache.check(request, db.get_change_seq)
+        if not_modified:
+            return not_modified
+        devices = db.iter_devices(
+            room=room, device_type=type, after_id=after_id, limit=limit, fields=field_list
+        )
+        return StreamingResponse(stream_devices(devices), media_type=NDJSON_MEDIA_TYPE, headers=headers)
+
+    if limit is not None or after_id is not None:
+        return await response_cache.respond(
+            request,
+            ("devices_page", room, type, after_id, limit, tuple(columns)),
+            lambda: db.get_devices_page(
+                room=room,
+                device_type=type,
+                after_id=after_id,
+                limit=limit or config.DEVICE_PAGE_SIZE,
+                fields=field_list
+            ),
+            db.get_change_seq
+        )
+
+    async def load_devices():
+        devices = await db.get_devices(room=room, device_type=type)
+        if field_list:
+            devices = [{column: device[column] for column in columns} for device in devices]
+        return devices
+
+    return await response_cache.respond(
+        request,
+        ("devices", room, type, tuple(columns)),
+        load_devices,
+        db.get_change_seq
+    )
 
 
 @app.get("/api/rooms")
-async def get_rooms():
+async def get_rooms(request: Request):
     """Get list of unique rooms."""
-    rooms = await db.get_rooms()
-    return rooms
+    return await response_cache.respond(request, ("rooms",), db.get_rooms, db.get_change_seq)
 
 
 @app.get("/api/stats", response_model=StatsResponse)
-async def get_stats():
+async def get_stats(request: Request):
     """Get dashboard statistics."""
-    stats = await db.get_stats()
-    return stats
+    return await response_cache.respond(request, ("stats",), db.get_stats, db.get_change_seq)
+
+
+async def get_dashboard_snapshot():
+    """The dashboard snapshot for the current data version (shared, read-only)."""
+    return await response_cache.get(("snapshot",), db.get_snapshot, db.get_change_seq)
+
+
+@app.get("/api/snapshot", response_model=SnapshotResponse)
+async def get_snapshot(request: Request):
+    """Get devices, rooms, stats and the active mode in one consistent response."""
+    async def build():
+        _, snapshot = await get_dashboard_snapshot()
+        return snapshot
+
+    return await response_cache.respond(request, ("snapshot",), build, db.get_change_seq)
+
+
+@app.post("/api/commands", response_model=CommandsResponse)
+async def post_commands(commands: List[DeviceCommandRequest]):
+    """
+    Apply a batch of device commands in one transaction.
+    
+    Each command is a target selector (``device_id``, or ``room`` and/or
+    ``device_type``) plus an action and its parameters, as for the
+    control_device MCP tool. Commands run in order and later ones see the
+    effect of earlier ones. The response has one result per command; a
+    command whose selector matches nothing gets an ``error`` and does not
+    stop the others.
+    """
+    if len(commands) > config.COMMANDS_MAX_BATCH:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Too many commands ({len(commands)}). At most {config.COMMANDS_MAX_BATCH} per request"
+        )
+    
+    results = await db.execute_commands([command.to_command() for command in commands])
+    changed = sum(change["changed"] for result in results for change in result["devices"])
+    if changed:
+        # Drop cached bodies now so this caller's next read sees its write
+        seq = await db.get_change_seq()
+        response_cache.set_version(seq)
+        notify_local_write(seq)
+    return {"results": results, "changed": changed}
+
+
+@app.get("/api/events", response_model=EventsResponse)
+async def get_events(
+    device_id: Optional[str] = None,
+    event_type: Optional[str] = None,
+    action: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    after_id: Optional[int] = None,
+    limit: int = Query(50, ge=1, le=500)
+):
+    """Get event history, newest first. Pass next_after_id as after_id for the next page."""
+    return await db.query_events(
+        device_id=device_id,
+        event_type=event_type,
+        action=action,
+        since=since,
+        until=until,
+        after_id=after_id,
+        limit=limit
+    )
+
+
+@app.get("/api/metrics")
+async def get_metrics():
+    """Get internal performance metrics."""
+    return {
+        "event_log": db.event_log.get_metrics(),
+        "broadcast_bus": broadcast_bus.get_metrics(),
+        "response_cache": response_cache.get_metrics(),
+        "websocket": ws_manager.get_metrics()
+    }
+
+
+async def load_snapshot(subscription: Subscription) -> Dict[str, Any]:
+    """The dashboard snapshot, limited to the devices a client subscribed to."""
+    _, snapshot = await get_dashboard_snapshot()
+    if subscription.is_everything:
+        return snapshot
+    return {
+        **snapshot,
+        "devices": [device for device in snapshot["devices"] if subscription.matches(device)]
+    }
+
+
+async def send_snapshot(websocket: WebSocket):
+    """Send the client's subscribed snapshot as a cached ``initial_data`` frame."""
+    # The committed change seq, so frames cached for it are dropped as soon
+    # as anything is written
+    version = await response_cache.current_version(db.get_change_seq)
+    await ws_manager.send_snapshot(websocket, version, load_snapshot)
+
+
+async def send_snapshot_or_resume(websocket: WebSocket, last_seq: Optional[int]):
+    """Replay changes since ``last_seq`` if possible, otherwise send a snapshot."""
+    if last_seq is None or not await ws_manager.resume(
+        websocket, last_seq, db.get_changes_delta, db.get_change_seq
+    ):
+        await send_snapshot(websocket)
 
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    """WebSocket endpoint for real-time updates."""
-    await ws_manager.connect(websocket)
+    """
+    WebSocket endpoint for real-time updates.
+    
+    Clients receive every device unless they subscribe to rooms, types or
+    device IDs, either with comma-separated query parameters
+    (``/ws?rooms=bedroom&types=light``) or by sending
+    ``{"type": "subscribe", "rooms": [...], "types": [...], "device_ids": [...]}``.
+    Each subscribe replaces the previous one and is answered with
+    ``subscribed`` and a filtered ``initial_data`` snapshot.
+    
+    Every update carries ``seq``. A reconnecting client passes the last seq
+    it saw (``?last_seq=42`` or ``{"type": "resume", "last_seq": 42}``) and
+    receives ``resumed`` plus only the changes it missed; if they are too
+    old it gets a fresh ``initial_data`` snapshot instead.
     
+    Server frames are JSON text by default. ``?encoding=msgpack`` and/or
+    ``?compression=deflate`` switch to binary frames; client messages are
+    always JSON text.
+    """
+    params = websocket.query_params
+    errors = []
+    last_seq = None
+    if params.get("last_seq"):
+        try:
+            last_seq = int(params["last_seq"])
+        except ValueError:
+            errors.append("'last_seq' must be an integer")
+    try:
+        subscription = Subscription.from_message(dict(params))
+    except ValueError as e:
+        subscription = Subscription()
+        errors.append(str(e))
     try:
-        # Send initial data
-        devices = await db.get_devices()
-        await websocket.send_json({
-            "type": "initial_data",
-            "devices": devices
-        })
+        frame_format = FrameFormat.parse(params.get("encoding"), params.get("compression"))
+    except ValueError as e:
+        frame_format = FrameFormat()
+        errors.append(str(e))
+    await ws_manager.connect(websocket, subscription, frame_format)
+    
+    try:
+        for error in errors:
+            await ws_manager.send(websocket, {"type": "error", "detail": error})
+        
+        # Send initial data (through the client's queue, like every frame),
+        # or only what a reconnecting client missed
+        await send_snapshot_or_resume(websocket, last_seq)
         
-        # Keep connection alive and listen for messages
+        # Keep connection alive and listen for subscription changes
         while True:
-            # We mostly broadcast from server to client
-            # But we can receive messages if needed
             try:
-                data = await asyncio.wait_for(websocket.receive_text(), timeout=30.0)
-                # Process incoming messages if needed
+                data = await asyncio.wait_for(
+                    websocket.receive_text(), timeout=config.WS_HEARTBEAT_INTERVAL
+                )
             except asyncio.TimeoutError:
                 # Send heartbeat
-                await websocket.send_json({"type": "ping"})
+                await ws_manager.send(websocket, {"type": "ping"})
+                continue
+            
+            try:
+                try:
+                    message = codec.loads(data)
+                except codec.JSONDecodeError:
+                    raise ValueError("Message must be valid JSON")
+                if not isinstance(message, dict):
+                    raise ValueError("Message must be a JSON object")
+                if message.get("type") == "resume":
+                    if not isinstance(message.get("last_seq"), int):
+                        raise ValueError("'last_seq' must be an integer")
+                    await send_snapshot_or_resume(websocket, message["last_seq"])
+                    continue
+                if message.get("type") != "subscribe":
+                    continue
+                subscription = Subscription.from_message(message)
+            except ValueError as e:
+                await ws_manager.send(websocket, {"type": "error", "detail": str(e)})
+                continue
+            
+            ws_manager.subscribe(websocket, subscription)
+            await ws_manager.send(websocket, {"type": "subscribed", **subscription.to_dict()})
+            await send_snapshot(websocket)
                 
     except WebSocketDisconnect:
         ws_manager.disconnect(websocket)
@@ -184,11 +555,13 @@ async def websocket_endpoint(websocket: WebSocket):
 
 if __name__ == "__main__":
     import uvicorn
+    # Auto-reload only works with a single worker
     uvicorn.run(
         "app.main:app",
         host=config.API_HOST,
         port=config.API_PORT,
-        reload=True,
+        reload=config.API_WORKERS == 1,
+        workers=config.API_WORKERS,
         log_level="info"
     )
 
@@ -3,7 +3,7 @@ import asyncio
 import json
 import sys
 from pathlib import Path
-from typing import Optional, Literal
+from typing import Any, Dict, List, Optional, Literal
 from datetime import datetime
 from contextlib import asynccontextmanager
 from mcp.server.fastmcp import FastMCP
@@ -13,7 +13,12 @@ sys.path.insert(0, str(Path(__file__).parent.parent))
 
 from app.config import config
 from app.db.database import db
-from app.utils.websocket_manager import ws_manager
+from app.db.device_actions import DeviceCommand, describe_change, describe_result
+from app.db.scenes import SCENES
+from app.models.device import DeviceCommandRequest
+from app.utils.change_notify import ChangePublisher
+from app.utils import codec
+from app.utils.tool_cache import ToolResultCache
 
 
 # Lifespan context manager for database
@@ -22,9 +27,12 @@ async def lifespan_context(app):
     """Initialize database connection."""
     await db.connect()
     await db.initialize_schema()
+    db.event_log.start()
     print("MCP Server: Database connected")
     yield
+    await db.event_log.stop()
     await db.disconnect()
+    change_publisher.close()
     print("MCP Server: Database disconnected")
 
 
@@ -44,11 +52,34 @@ mcp = FastMCP(
 )
 
 
+# Publishes committed changes to the API server, which broadcasts them
+change_publisher = ChangePublisher()
+
+# Results of read-only tools, reused until either process commits a change
+tool_cache = ToolResultCache(db.get_data_version)
+
+
+@mcp.resource("home://metrics/tool-cache", mime_type="application/json")
+def tool_cache_metrics() -> str:
+    """Hit and miss counters of the read-only tool result cache."""
+    return codec.dumps(tool_cache.get_metrics())
+
+
 # Helper function to signal updates to WebSocket clients
-def signal_ws_update(update_type: str, **kwargs):
-    """Signal WebSocket manager about updates."""
-    update_data = {"type": update_type, **kwargs}
-    ws_manager.signal_update(update_data)
+async def signal_changes():
+    """
+    Notify the API server (and its WebSocket clients) after a commit.
+    
+    One notification per commit carries the latest change seq; the API
+    server reads what changed from the changes table.
+    """
+    change_publisher.publish(await db.get_change_seq())
+
+
+async def signal_device_changes(results: List[Dict[str, Any]]):
+    """Signal once if ``Database.execute_commands`` changed any device."""
+    if any(change["changed"] for result in results for change in result["devices"]):
+        await signal_changes()
 
 
 @mcp.tool()
@@ -83,117 +114,98 @@ async def control_device(
         - Close all blinds: control_device("close", device_type="blinds")
     """
     
-    # Get target devices
-    if device_id:
-        devices = [await db.get_device(device_id)]
-        if not devices[0]:
-            return f"❌ Device '{device_id}' not found."
-    else:
-        devices = await db.get_devices(room=room, device_type=device_type)
-    
-    if not devices:
-        filter_desc = []
-        if room:
-            filter_desc.append(f"room={room}")
-        if device_type:
-            filter_desc.append(f"type={device_type}")
-        return f"❌ No devices found matching: {', '.join(filter_desc)}"
+    params = {
+        "brightness": brightness,
+        "position": position,
+        "speed": speed,
+        "target_temp": target_temp,
+        "mode": mode
+    }
+    command = DeviceCommand(
+        action=action,
+        device_id=device_id,
+        room=room,
+        device_type=device_type,
+        params={name: value for name, value in params.items() if value is not None}
+    )
     
-    results = []
+    # Resolve targets and apply all changes with a single commit
+    [result] = await db.execute_commands([command])
     
-    for device in devices:
-        dev_id = device["id"]
-        dev_type = device["type"]
-        current_state = device["state"]
-        properties = device.get("properties", {})
-        
-        # Determine new state and properties based on action and device type
-        new_state = None
-        new_properties = properties.copy()
-        
-        # Handle actions
-        if action in ["on", "off"]:
-            if dev_type in ["light", "fan", "sprinkler", "ev_charger"]:
-                new_state = action
-                if dev_type == "light" and brightness is not None:
-                    new_properties["brightness"] = max(0, min(100, brightness))
-                elif dev_type == "light" and action == "on" and new_properties.get("brightness", 0) == 0:
-                    new_properties["brightness"] = 100
-                elif dev_type == "light" and action == "off":
-                    new_properties["brightness"] = 0
-                elif dev_type == "fan" and speed is not None:
-                    new_properties["speed"] = max(0, min(3, speed))
-        
-        elif action in ["open", "close"]:
-            if dev_type in ["blinds", "garage"]:
-                new_state = action
-                if dev_type == "blinds":
-                    new_properties["position"] = 100 if action == "open" else 0
-                    if position is not None:
-                        new_properties["position"] = max(0, min(100, position))
-                        new_state = "open" if position > 0 else "closed"
-        
-        elif action in ["lock", "unlock"]:
-            if dev_type == "lock":
-                new_state = "locked" if action == "lock" else "unlocked"
-        
-        elif action == "set":
-            if dev_type == "light" and brightness is not None:
-                new_state = "on" if brightness > 0 else "off"
-                new_properties["brightness"] = max(0, min(100, brightness))
-            elif dev_type == "blinds" and position is not None:
-                new_properties["position"] = max(0, min(100, position))
-                new_state = "open" if position > 0 else "closed"
-            elif dev_type == "fan" and speed is not None:
-                new_properties["speed"] = max(0, min(3, speed))
-                new_state = "on" if speed > 0 else "off"
-            elif dev_type == "thermostat":
-                if target_temp is not None:
-                    new_properties["target_temp"] = target_temp
-                if mode is not None:
-                    new_properties["mode"] = mode
-                    new_state = mode
-        
-        elif action == "toggle":
-            if dev_type in ["light", "fan"]:
-                new_state = "off" if current_state == "on" else "on"
-                if dev_type == "light":
-                    new_properties["brightness"] = 100 if new_state == "on" else 0
-            elif dev_type in ["blinds", "garage"]:
-                new_state = "closed" if current_state == "open" else "open"
-                if dev_type == "blinds":
-                    new_properties["position"] = 0 if new_state == "closed" else 100
-            elif dev_type == "lock":
-                new_state = "unlocked" if current_state == "locked" else "locked"
-        
-        # Update device if state changed
-        if new_state or new_properties != properties:
-            await db.update_device(dev_id, state=new_state, properties=new_properties)
-            await db.log_event("device_control", dev_id, action, {"new_state": new_state, "properties": new_properties})
-            
-            # Signal WebSocket update
-            signal_ws_update(
-                "device_update",
-                device_id=dev_id,
-                room=device.get("room"),
-                device_type=dev_type,
-                state=new_state or current_state,
-                properties=new_properties
-            )
-            
-            result_msg = f"✅ {dev_id}: {current_state} → {new_state or current_state}"
-            if dev_type == "light" and "brightness" in new_properties:
-                result_msg += f" (brightness: {new_properties['brightness']}%)"
-            elif dev_type == "thermostat" and "target_temp" in new_properties:
-                result_msg += f" (target: {new_properties['target_temp']}°F)"
-            results.append(result_msg)
-        else:
-            results.append(f"ℹ️ {dev_id}: No change needed (already {current_state})")
+    # Signal WebSocket updates
+    await signal_device_changes([result])
     
-    return "\n".join(results)
+    return "\n".join(describe_result(result))
+
+
+@mcp.tool()
+async def execute_batch(
+    operations: List[DeviceCommandRequest],
+    atomic: bool = True
+) -> str:
+    """
+    Run several device operations in one call and one database transaction.
+
+    Use this instead of several control_device calls when a request touches
+    more than one device or room. Each operation takes the same fields as
+    control_device (action, device_id / room / device_type, brightness,
+    position, speed, target_temp, mode) and they run in order.
+
+    Args:
+        operations: Operations to run, in order
+        atomic: If true (default) nothing changes unless every operation finds
+            its devices; if false, failed operations are skipped
+
+    Example:
+        - "Dim the bedroom, lock the front door, set 68°F and close the garage":
+          execute_batch([
+              {"action": "set", "room": "bedroom", "device_type": "light", "brightness": 20},
+              {"action": "lock", "device_id": "front_door_lock"},
+              {"action": "set", "device_type": "thermostat", "target_temp": 68},
+              {"action": "close", "device_type": "garage"}
+          ])
+    """
+    if not operations:
+        return "❌ No operations given."
+    if len(operations) > config.COMMANDS_MAX_BATCH:
+        return f"❌ Too many operations ({len(operations)}). At most {config.COMMANDS_MAX_BATCH} per batch."
+
+    commands = [operation.to_command() for operation in operations]
+    try:
+        results = await db.execute_commands(commands, atomic=atomic)
+    except ValueError as e:
+        return f"❌ {e}"
+
+    failed = [(i, result["error"]) for i, result in enumerate(results, 1) if result["error"]]
+    if atomic and failed:
+        lines = ["❌ Batch not applied, nothing was changed:"]
+        lines.extend(f"  {i}. {error}" for i, error in failed)
+        return "\n".join(lines)
+
+    await signal_device_changes(results)
+
+    changed = sum(change["changed"] for result in results for change in result["devices"])
+    lines = [
+        f"✅ Batch: {len(results) - len(failed)}/{len(results)} operations applied, "
+        f"{changed} device(s) changed"
+    ]
+    for i, (command, result) in enumerate(zip(commands, results), 1):
+        if result["error"]:
+            lines.append(f"  {i}. ❌ {result['error']}")
+            continue
+        changes = [change for change in result["devices"] if change["changed"]]
+        unchanged = len(result["devices"]) - len(changes)
+        summary = f"  {i}. {command.action} {command.describe_target()}"
+        if unchanged:
+            summary += f" ({unchanged} unchanged)"
+        lines.append(summary)
+        lines.extend(f"     {describe_change(change)}" for change in changes)
+
+    return "\n".join(lines)
 
 
 @mcp.tool()
+@tool_cache.cached
 async def get_device_status(
     device_id: Optional[str] = None,
     room: Optional[str] = None,
@@ -292,6 +304,7 @@ def format_device_status(device: dict) -> str:
 
 
 @mcp.tool()
+@tool_cache.cached
 async def get_sensor_reading(
     sensor_type: Literal["temperature", "motion", "humidity", "air_quality"],
     room: Optional[str] = None
@@ -365,88 +378,24 @@ async def set_home_mode(
         - Going to bed: set_home_mode("sleep")
     """
     
-    # Get all devices
-    devices = await db.get_devices()
+    scene = SCENES[mode]
     
-    actions = []
+    # Apply the scene and the mode switch in one transaction
+    async with db.transaction():
+        changed = await db.apply_scene(scene)
+        await db.set_home_mode(mode)
+        await db.log_event("mode_change", action=mode, metadata={"actions_count": len(changed)})
     
-    # Define mode behaviors
-    if mode == "home":
-        # Turn on main lights, set comfortable temp
-        for device in devices:
-            if device["type"] == "light" and "main" in device["id"]:
-                await db.update_device(device["id"], state="on", properties={"brightness": 75, **device.get("properties", {})})
-                actions.append(f"💡 {device['id']}: ON (75%)")
-            elif device["type"] == "thermostat":
-                props = device.get("properties", {})
-                props["target_temp"] = 72
-                props["mode"] = "auto"
-                await db.update_device(device["id"], state="auto", properties=props)
-                actions.append(f"🌡️ Thermostat: 72°F (auto)")
-    
-    elif mode == "away":
-        # Turn off lights, lock doors, lower temp
-        for device in devices:
-            if device["type"] == "light":
-                await db.update_device(device["id"], state="off", properties={"brightness": 0, **device.get("properties", {})})
-                actions.append(f"💡 {device['id']}: OFF")
-            elif device["type"] == "lock" and device["state"] != "locked":
-                await db.update_device(device["id"], state="locked")
-                actions.append(f"🔒 {device['id']}: LOCKED")
-            elif device["type"] == "thermostat":
-                props = device.get("properties", {})
-                props["target_temp"] = 65
-                await db.update_device(device["id"], properties=props)
-                actions.append(f"🌡️ Thermostat: 65°F")
-    
-    elif mode == "sleep":
-        # Most lights off, bedroom dim, lock doors
-        for device in devices:
-            if device["type"] == "light":
-                if "bedroom" in device["id"]:
-                    await db.update_device(device["id"], state="on", properties={"brightness": 20, **device.get("properties", {})})
-                    actions.append(f"💡 {device['id']}: DIM (20%)")
-                else:
-                    await db.update_device(device["id"], state="off", properties={"brightness": 0, **device.get("properties", {})})
-                    actions.append(f"💡 {device['id']}: OFF")
-            elif device["type"] == "lock" and device["state"] != "locked":
-                await db.update_device(device["id"], state="locked")
-                actions.append(f"🔒 {device['id']}: LOCKED")
-            elif device["type"] == "thermostat":
-                props = device.get("properties", {})
-                props["target_temp"] = 68
-                await db.update_device(device["id"], properties=props)
-                actions.append(f"🌡️ Thermostat: 68°F")
-    
-    elif mode == "vacation":
-        # Everything off and secured
-        for device in devices:
-            if device["type"] == "light":
-                await db.update_device(device["id"], state="off", properties={"brightness": 0, **device.get("properties", {})})
-                actions.append(f"💡 {device['id']}: OFF")
-            elif device["type"] == "lock" and device["state"] != "locked":
-                await db.update_device(device["id"], state="locked")
-                actions.append(f"🔒 {device['id']}: LOCKED")
-            elif device["type"] == "garage" and device["state"] != "closed":
-                await db.update_device(device["id"], state="closed")
-                actions.append(f"🚗 Garage: CLOSED")
-            elif device["type"] == "thermostat":
-                props = device.get("properties", {})
-                props["target_temp"] = 60
-                await db.update_device(device["id"], properties=props)
-                actions.append(f"🌡️ Thermostat: 60°F")
-    
-    # Update mode in database
-    await db.set_home_mode(mode)
-    await db.log_event("mode_change", action=mode, metadata={"actions_count": len(actions)})
+    actions = [device["action"] for device in changed] or ["ℹ️ No device changes needed"]
     
     # Signal WebSocket update
-    signal_ws_update("mode_change", mode=mode)
+    await signal_changes()
     
     return f"🏠 Home mode set to: {mode.upper()}\n\nActions taken:\n" + "\n".join(actions)
 
 
 @mcp.tool()
+@tool_cache.cached
 async def get_home_mode() -> str:
     """
     Get the current home automation mode.
@@ -470,6 +419,51 @@ async def get_home_mode() -> str:
     return f"Current mode: {mode.upper()}\n{description}"
 
 
+@mcp.tool()
+async def get_device_history(
+    device_id: Optional[str] = None,
+    event_type: Optional[str] = None,
+    action: Optional[str] = None,
+    since: Optional[str] = None,
+    limit: int = 10
+) -> str:
+    """
+    Look up past device events, most recent first.
+    
+    Args:
+        device_id: Specific device ID (optional)
+        event_type: Event type, e.g. device_control, mode_change, watering (optional)
+        action: Action taken, e.g. on, off, open, lock (optional)
+        since: Only events after this ISO timestamp (optional)
+        limit: Maximum number of events (default: 10)
+    
+    Examples:
+        - When was the garage last opened: get_device_history(device_id="garage_door", action="open", limit=1)
+        - Recent mode changes: get_device_history(event_type="mode_change")
+    """
+    
+    page = await db.query_events(
+        device_id=device_id,
+        event_type=event_type,
+        action=action,
+        since=since,
+        limit=max(1, min(limit, 100))
+    )
+    events = page["events"]
+    
+    if not events:
+        return "No matching events found."
+    
+    output = ["📜 Event history (newest first):"]
+    for event in events:
+        when = event["timestamp"].replace("T", " ")[:19]
+        target = f" {event['device_id']}" if event.get("device_id") else ""
+        action_str = f" → {event['action']}" if event.get("action") else ""
+        output.append(f"  🕒 {when}: {event['event_type']}{target}{action_str}")
+    
+    return "\n".join(output)
+
+
 @mcp.tool()
 async def feed_fish() -> str:
     """
@@ -492,12 +486,12 @@ async def feed_fish() -> str:
     await db.log_event("fish_feeding", "fish_feeder", "feed", {"timestamp": now})
     
     # Signal update
-    signal_ws_update("device_update", device_id="fish_feeder", state="feeding", properties=props)
+    await signal_changes()
     
     # Reset to idle after a moment (simulated)
     await asyncio.sleep(0.5)
     await db.update_device("fish_feeder", state="idle", properties=props)
-    signal_ws_update("device_update", device_id="fish_feeder", state="idle", properties=props)
+    await signal_changes()
     
     return f"🐠 Fish fed successfully at {datetime.now().strftime('%I:%M %p')}"
 
@@ -519,33 +513,33 @@ async def water_plants(
         - Water all zones: water_plants(duration=20)
     """
     
-    # Get sprinklers
-    sprinklers = await db.get_devices(device_type="sprinkler")
-    
-    if not sprinklers:
-        return "❌ No sprinkler systems found."
-    
-    # Filter by zone if specified
+    # Get sprinklers, filtered by zone in SQL if specified
     if zone:
-        sprinklers = [s for s in sprinklers if s.get("properties", {}).get("zone") == zone]
-    
-    if not sprinklers:
-        return f"❌ No sprinklers found for zone: {zone}"
+        sprinklers = await db.get_devices(device_type="sprinkler", where=[("zone", "=", zone)])
+        if not sprinklers:
+            return f"❌ No sprinklers found for zone: {zone}"
+    else:
+        sprinklers = await db.get_devices(device_type="sprinkler")
+        if not sprinklers:
+            return "❌ No sprinkler systems found."
     
     actions = []
+    updates = []
+    events = []
     
     for sprinkler in sprinklers:
         props = sprinkler.get("properties", {})
         props["duration"] = duration
         zone_name = props.get("zone", "unknown")
         
-        await db.update_device(sprinkler["id"], state="on", properties=props)
-        await db.log_event("watering", sprinkler["id"], "start", {"duration": duration, "zone": zone_name})
-        
-        signal_ws_update("device_update", device_id=sprinkler["id"], state="on", properties=props)
+        updates.append((sprinkler["id"], "on", props))
+        events.append(("watering", sprinkler["id"], "start", {"duration": duration, "zone": zone_name}))
         
         actions.append(f"💧 {zone_name.replace('_', ' ').title()}: ON for {duration} minutes")
     
+    await db.update_devices_bulk(updates, events)
+    await signal_changes()
+    
     return "🌱 Watering started:\n" + "\n".join(actions)
 
 
@@ -571,7 +565,7 @@ async def start_ev_charging() -> str:
     await db.update_device("ev_charger", state="charging", properties=props)
     await db.log_event("ev_charging", "ev_charger", "start")
     
-    signal_ws_update("device_update", device_id="ev_charger", state="charging", properties=props)
+    await signal_changes()
     
     battery = props.get("battery_level", 0)
     return f"🔌 EV charging started. Current battery: {battery}%"
@@ -599,7 +593,7 @@ async def stop_ev_charging() -> str:
     await db.update_device("ev_charger", state="idle", properties=props)
     await db.log_event("ev_charging", "ev_charger", "stop")
     
-    signal_ws_update("device_update", device_id="ev_charger", state="idle", properties=props)
+    await signal_changes()
     
     battery = props.get("battery_level", 0)
     return f"🔌 EV charging stopped. Battery level: {battery}%"
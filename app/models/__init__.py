@@ -1,5 +1,5 @@
 """Models module for home automation."""
-from app.models.device import Device, DeviceUpdate, DeviceType, DeviceState, Event
+from app.models.device import Device, DeviceCommandRequest, DeviceUpdate, DeviceType, DeviceState, Event
 
-__all__ = ["Device", "DeviceUpdate", "DeviceType", "DeviceState", "Event"]
+__all__ = ["Device", "DeviceCommandRequest", "DeviceUpdate", "DeviceType", "DeviceState", "Event"]
 
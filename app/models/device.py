@@ -2,6 +2,7 @@
 from typing import Optional, Dict, Any, Literal
 from pydantic import BaseModel, Field
 from datetime import datetime
+from app.db.device_actions import ACTION_PARAMS, DeviceCommand
 
 
 # Device types
@@ -59,6 +60,30 @@ class DeviceUpdate(BaseModel):
     properties: Optional[Dict[str, Any]] = None
 
 
+class DeviceCommandRequest(BaseModel):
+    """One command of a bulk control request (see POST /api/commands)."""
+    action: Literal["on", "off", "open", "close", "set", "toggle", "lock", "unlock"]
+    device_id: Optional[str] = None
+    room: Optional[str] = None
+    device_type: Optional[str] = None
+    brightness: Optional[int] = None
+    position: Optional[int] = None
+    speed: Optional[int] = None
+    target_temp: Optional[int] = None
+    mode: Optional[str] = None
+    
+    def to_command(self) -> DeviceCommand:
+        """The command to pass to ``Database.execute_commands``."""
+        params = {name: getattr(self, name) for name in ACTION_PARAMS}
+        return DeviceCommand(
+            action=self.action,
+            device_id=self.device_id,
+            room=self.room,
+            device_type=self.device_type,
+            params={name: value for name, value in params.items() if value is not None}
+        )
+
+
 class Event(BaseModel):
     """Event log model."""
     id: Optional[int] = None
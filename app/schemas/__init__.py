@@ -1,19 +1,23 @@
 """Schemas module for API responses."""
 from app.schemas.responses import (
     DevicesResponse,
+    EventsResponse,
     RoomsResponse,
     StatsResponse,
     WebSocketMessage,
     LightStats,
     DoorStats,
+    TypeStats,
 )
 
 __all__ = [
     "DevicesResponse",
+    "EventsResponse",
     "RoomsResponse",
     "StatsResponse",
     "WebSocketMessage",
     "LightStats",
     "DoorStats",
+    "TypeStats",
 ]
 
@@ -1,12 +1,13 @@
 """API response schemas."""
 from typing import List, Dict, Any, Optional
 from pydantic import BaseModel
-from app.models.device import Device
+from app.models.device import Device, Event
 
 
 class DevicesResponse(BaseModel):
-    """Response for device list."""
+    """Response for device list (a page when paginating)."""
     devices: List[Device] = []
+    next_after_id: Optional[str] = None
 
 
 class RoomsResponse(BaseModel):
@@ -14,6 +15,35 @@ class RoomsResponse(BaseModel):
     rooms: List[str] = []
 
 
+class EventsResponse(BaseModel):
+    """Response for a page of event history."""
+    events: List[Event] = []
+    next_after_id: Optional[int] = None
+
+
+class DeviceChange(BaseModel):
+    """What a command did to one device."""
+    device_id: str
+    room: Optional[str] = None
+    device_type: str
+    previous_state: str
+    state: str
+    properties: Dict[str, Any] = {}
+    changed: bool
+
+
+class CommandResult(BaseModel):
+    """Result of one command; ``error`` is set when its target matched nothing."""
+    error: Optional[str] = None
+    devices: List[DeviceChange] = []
+
+
+class CommandsResponse(BaseModel):
+    """Response for a bulk control request."""
+    results: List[CommandResult] = []
+    changed: int = 0  # devices changed by all commands
+
+
 class LightStats(BaseModel):
     """Light statistics."""
     on: int = 0
@@ -26,6 +56,12 @@ class DoorStats(BaseModel):
     total: int = 0
 
 
+class TypeStats(BaseModel):
+    """Per device type statistics."""
+    total: int = 0
+    states: Dict[str, int] = {}
+
+
 class StatsResponse(BaseModel):
     """Dashboard statistics response."""
     lights: LightStats
@@ -33,15 +69,35 @@ class StatsResponse(BaseModel):
     total_devices: int
     garage_open: bool = False
     active_mode: Optional[str] = None
+    by_type: Dict[str, TypeStats] = {}
+
+
+class SnapshotResponse(BaseModel):
+    """Everything the dashboard shows, from one consistent read."""
+    devices: List[Device] = []
+    rooms: List[str] = []
+    stats: StatsResponse
+    active_mode: Optional[str] = None
+    seq: int = 0  # change sequence number the snapshot reflects
 
 
 class WebSocketMessage(BaseModel):
     """WebSocket message format."""
-    type: str  # device_update, mode_change, full_refresh
+    type: str  # device_update, devices_delta, mode_change, full_refresh, subscribe(d), resume(d)
     device_id: Optional[str] = None
     room: Optional[str] = None
     device_type: Optional[str] = None
     state: Optional[str] = None
     properties: Optional[Dict[str, Any]] = None
     mode: Optional[str] = None
+    devices: Optional[List[Device]] = None  # changed rows (devices_delta)
+    deleted: Optional[List[str]] = None  # removed device IDs (devices_delta)
+    stats: Optional[StatsResponse] = None  # stats after the change
+    seq: Optional[int] = None  # change sequence number
+    rooms: Optional[List[str]] = None  # subscription filters, or all rooms in initial_data
+    types: Optional[List[str]] = None
+    device_ids: Optional[List[str]] = None
+    last_seq: Optional[int] = None  # last seq seen by a resuming client
+    replayed: Optional[bool] = None  # sent while resuming a session
+    active_mode: Optional[str] = None  # initial_data
 
@@ -1,5 +1,5 @@
 """Utilities module for home automation."""
-from app.utils.websocket_manager import WebSocketManager, ws_manager
+from app.utils.websocket_manager import Subscription, WebSocketManager, ws_manager
 
-__all__ = ["WebSocketManager", "ws_manager"]
+__all__ = ["Subscription", "WebSocketManager", "ws_manager"]
 
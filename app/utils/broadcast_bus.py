@@ -0,0 +1,244 @@
+"""Broadcast bus carrying change events from the leader worker to all workers.
+
+With a single API worker the in-process bus hands events straight to the
+local WebSocket manager. With ``API_WORKERS > 1`` every worker tries to take
+a lock file; the one that gets it becomes the leader, runs change detection
+and hosts a small broker on loopback TCP. The other workers connect to the
+broker and fan the events it relays out to their own clients. When the
+leader dies the OS releases its lock and a follower takes over.
+
+Events are dicts such as ``{"event": "delta", "devices": [...], ...}``, sent
+over the broker as newline-delimited JSON.
+"""
+import asyncio
+import os
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+from app.config import config
+from app.utils import codec
+from app.utils.file_lock import FileLock
+
+
+EventHandler = Callable[[Dict[str, Any]], Awaitable[None]]
+ElectedCallback = Callable[[], Awaitable[None]]
+
+# Delivered locally when a worker may have missed events
+RESYNC_EVENT = {"event": "full_refresh", "seq": None}
+
+# Largest event line a follower accepts (a full delta of many devices)
+MAX_EVENT_SIZE = 16 * 1024 * 1024
+
+
+class BroadcastBus:
+    """
+    In-process bus: this worker is always the leader and the only consumer.
+
+    ``start`` registers the handler that applies events to the local clients
+    and calls ``on_elected`` once this worker should run change detection.
+    """
+
+    backend = "in_process"
+
+    def __init__(self):
+        self._handler: Optional[EventHandler] = None
+        self.is_leader = False
+        self.events_published = 0
+        self.events_received = 0
+
+    @property
+    def is_local(self) -> bool:
+        """Whether the leader's clients are the only clients."""
+        return True
+
+    async def start(self, handler: EventHandler, on_elected: ElectedCallback):
+        """Start delivering events to ``handler``."""
+        self._handler = handler
+        self.is_leader = True
+        await on_elected()
+
+    async def publish(self, event: Dict[str, Any]):
+        """Deliver an event to every worker (leader only)."""
+        self.events_published += 1
+        await self._deliver(event)
+
+    async def stop(self):
+        """Stop the bus."""
+        self.is_leader = False
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Role and event counters of this worker."""
+        return {
+            "backend": self.backend,
+            "pid": os.getpid(),
+            "role": "leader" if self.is_leader else "follower",
+            "events_published": self.events_published,
+            "events_received": self.events_received
+        }
+
+    async def _deliver(self, event: Dict[str, Any]):
+        """Hand an event to the local handler."""
+        self.events_received += 1
+        if self._handler:
+            await self._handler(event)
+
+
+class LoopbackBus(BroadcastBus):
+    """
+    Multi-process bus for several workers on one host.
+
+    The leader is elected through ``lock_path`` and serves a broker on
+    ``host:port``. Followers that lose the broker (for example because the
+    leader exited) try to become leader, or reconnect; either way their
+    clients get a ``full_refresh`` since events may have been missed.
+    Followers whose socket backs up beyond ``max_buffer`` bytes are cut off
+    and resync the same way.
+    """
+
+    backend = "loopback"
+
+    def __init__(
+        self,
+        host: str = config.BUS_HOST,
+        port: int = config.BUS_PORT,
+        lock_path: Path = config.BUS_LOCK_PATH,
+        retry_interval: float = config.BUS_RETRY_INTERVAL,
+        max_buffer: int = config.BUS_MAX_BUFFER
+    ):
+        super().__init__()
+        self.host = host
+        self.port = port
+        self.lock = FileLock(lock_path)
+        self.retry_interval = retry_interval
+        self.max_buffer = max_buffer
+        self._on_elected: Optional[ElectedCallback] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._followers: Set[asyncio.StreamWriter] = set()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def is_local(self) -> bool:
+        return False
+
+    async def start(self, handler: EventHandler, on_elected: ElectedCallback):
+        """Join the bus as leader or follower."""
+        self._handler = handler
+        self._on_elected = on_elected
+        self._task = asyncio.create_task(self._run())
+
+    async def publish(self, event: Dict[str, Any]):
+        """Deliver an event locally and relay it to every follower."""
+        self.events_published += 1
+        line = codec.dumps_bytes(event) + b"\n"
+        for writer in list(self._followers):
+            if writer.transport.get_write_buffer_size() > self.max_buffer:
+                print("Broadcast bus: dropping a follower that fell behind")
+                self._drop_follower(writer)
+                continue
+            writer.write(line)
+        await self._deliver(event)
+
+    async def stop(self):
+        """Leave the bus and release leadership."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        for writer in list(self._followers):
+            self._drop_follower(writer)
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        self.lock.release()
+        self.is_leader = False
+
+    def get_metrics(self) -> Dict[str, Any]:
+        metrics = super().get_metrics()
+        metrics["broker"] = f"tcp://{self.host}:{self.port}"
+        metrics["followers"] = len(self._followers)
+        return metrics
+
+    async def _run(self):
+        """Follow the current leader until this worker can take over."""
+        missed_events = False
+        while True:
+            if self.lock.acquire():
+                try:
+                    await self._lead(resync=missed_events)
+                    return
+                except OSError as e:
+                    print(f"Broadcast bus: cannot serve on {self.host}:{self.port} ({e})")
+                    self.lock.release()
+                    self.is_leader = False
+                    await asyncio.sleep(self.retry_interval)
+                    continue
+
+            try:
+                await self._follow(resync=missed_events)
+            except OSError:
+                pass
+            # Anything published while disconnected was missed
+            missed_events = True
+            await asyncio.sleep(self.retry_interval)
+
+    async def _lead(self, resync: bool):
+        """Serve the broker and start change detection."""
+        self._server = await asyncio.start_server(self._accept_follower, self.host, self.port)
+        self.is_leader = True
+        print(f"Broadcast bus: worker {os.getpid()} is the leader (tcp://{self.host}:{self.port})")
+        if resync:
+            await self._deliver(RESYNC_EVENT)
+        await self._on_elected()
+
+    async def _follow(self, resync: bool):
+        """Apply events relayed by the leader until the connection drops."""
+        reader, writer = await asyncio.open_connection(self.host, self.port, limit=MAX_EVENT_SIZE)
+        print(f"Broadcast bus: worker {os.getpid()} is following the leader")
+        try:
+            if resync:
+                await self._deliver(RESYNC_EVENT)
+            while True:
+                line = await reader.readline()
+                if not line:
+                    return
+                try:
+                    event = codec.loads(line)
+                except codec.JSONDecodeError:
+                    continue
+                await self._deliver(event)
+        finally:
+            writer.close()
+
+    async def _accept_follower(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Register a follower connection (the leader only writes to it)."""
+        self._followers.add(writer)
+        try:
+            # Followers never send; returns when they disconnect
+            await reader.read()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            self._drop_follower(writer)
+
+    def _drop_follower(self, writer: asyncio.StreamWriter):
+        """Forget and close a follower connection."""
+        self._followers.discard(writer)
+        writer.close()
+
+
+def create_bus() -> BroadcastBus:
+    """Bus matching the configured backend (``auto`` picks by API_WORKERS)."""
+    backend = config.BROADCAST_BUS
+    if backend == "auto":
+        backend = "loopback" if config.API_WORKERS > 1 else "in_process"
+    if backend == "loopback":
+        return LoopbackBus()
+    if backend == "in_process":
+        return BroadcastBus()
+    raise ValueError(f"Invalid broadcast bus: {backend}. Must be one of auto, in_process, loopback")
+
+
+# Global broadcast bus instance
+broadcast_bus = create_bus()
@@ -0,0 +1,72 @@
+"""Loopback change notifications from the MCP stdio server to the API server.
+
+The MCP process publishes one small datagram carrying the latest change seq
+right after each commit (however many devices it changed) and the API server
+wakes its change feed immediately instead of waiting for the next poll; the
+feed then reads the exact changes from the changes table by seq. UDP on 127.0.0.1 is used so it works on every platform (including
+Windows) and publishing never blocks or fails when the API server is down.
+"""
+import asyncio
+import socket
+from typing import Any, Callable, Dict, Optional
+from app.config import config
+from app.utils import codec
+
+
+class ChangePublisher:
+    """Publishes change notifications to the API server (fire-and-forget)."""
+
+    def __init__(
+        self,
+        host: str = config.CHANGE_NOTIFY_HOST,
+        port: int = config.CHANGE_NOTIFY_PORT
+    ):
+        self.address = (host, port)
+        self._socket: Optional[socket.socket] = None
+
+    def publish(self, seq: int):
+        """Announce a commit up to change ``seq``; errors are ignored."""
+        payload = codec.dumps_bytes({"type": "changes", "seq": seq})
+
+        try:
+            if self._socket is None:
+                self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                self._socket.setblocking(False)
+            self._socket.sendto(payload, self.address)
+        except OSError:
+            pass
+
+    def close(self):
+        """Close the publishing socket."""
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+
+class _ChangeListenerProtocol(asyncio.DatagramProtocol):
+    """Decodes notification datagrams and hands them to a callback."""
+
+    def __init__(self, on_change: Callable[[Dict[str, Any]], None]):
+        self._on_change = on_change
+
+    def datagram_received(self, data: bytes, addr):
+        try:
+            message = codec.loads(data)
+        except codec.JSONDecodeError:
+            return
+        if isinstance(message, dict):
+            self._on_change(message)
+
+
+async def start_change_listener(
+    on_change: Callable[[Dict[str, Any]], None],
+    host: str = config.CHANGE_NOTIFY_HOST,
+    port: int = config.CHANGE_NOTIFY_PORT
+) -> asyncio.DatagramTransport:
+    """Listen for change notifications; close the returned transport to stop."""
+    loop = asyncio.get_running_loop()
+    transport, _ = await loop.create_datagram_endpoint(
+        lambda: _ChangeListenerProtocol(on_change),
+        local_addr=(host, port)
+    )
+    return transport
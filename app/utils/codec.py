@@ -0,0 +1,112 @@
+"""JSON codec used on all hot paths (DB rows, REST responses, WebSocket frames).
+
+Uses orjson when it is installed and falls back to the stdlib json module.
+WebSocket clients may also negotiate MessagePack (when msgpack is installed)
+and/or zlib deflate compressed frames, see ``FrameFormat``.
+"""
+import json
+import zlib
+from typing import Any, NamedTuple, Optional, Union
+from fastapi.responses import JSONResponse as _StarletteJSONResponse
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - depends on the environment
+    msgpack = None
+
+
+# orjson.JSONDecodeError subclasses json.JSONDecodeError
+JSONDecodeError = json.JSONDecodeError
+
+BACKEND = "orjson" if orjson else "json"
+
+
+if orjson:
+    def dumps_bytes(obj: Any) -> bytes:
+        """Serialize to UTF-8 encoded JSON bytes."""
+        return orjson.dumps(obj)
+
+    def dumps(obj: Any) -> str:
+        """Serialize to a JSON string."""
+        return orjson.dumps(obj).decode()
+
+    def loads(data: Union[str, bytes]) -> Any:
+        """Deserialize a JSON string or bytes."""
+        return orjson.loads(data)
+else:
+    def dumps_bytes(obj: Any) -> bytes:
+        """Serialize to UTF-8 encoded JSON bytes."""
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode()
+
+    def dumps(obj: Any) -> str:
+        """Serialize to a JSON string."""
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+    def loads(data: Union[str, bytes]) -> Any:
+        """Deserialize a JSON string or bytes."""
+        return json.loads(data)
+
+
+class JSONResponse(_StarletteJSONResponse):
+    """FastAPI response class that renders through the codec."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps_bytes(content)
+
+
+# WebSocket frame encodings and compressions clients can ask for
+FRAME_ENCODINGS = ("json", "msgpack")
+FRAME_COMPRESSIONS = ("deflate",)
+
+# zlib level for compressed frames; 6 is the usual size/speed trade-off
+DEFLATE_LEVEL = 6
+
+# A frame ready to send: str for JSON text frames, bytes for binary frames
+Frame = Union[str, bytes]
+
+
+class FrameFormat(NamedTuple):
+    """
+    How a WebSocket client wants its frames encoded.
+    
+    Plain JSON goes out as text frames. MessagePack and deflate (zlib
+    format, readable with ``DecompressionStream("deflate")``) go out as
+    binary frames. Compression happens once per message in the app, so the
+    compressed bytes are shared by every client using the same format.
+    """
+    encoding: str = "json"
+    compression: Optional[str] = None
+    
+    @classmethod
+    def parse(cls, encoding: Optional[str] = None, compression: Optional[str] = None) -> "FrameFormat":
+        """Validate a requested format; raises ValueError if unsupported."""
+        encoding = encoding or "json"
+        if encoding not in FRAME_ENCODINGS:
+            raise ValueError(
+                f"Invalid encoding: {encoding}. Must be one of {', '.join(FRAME_ENCODINGS)}"
+            )
+        if encoding == "msgpack" and msgpack is None:
+            raise ValueError("msgpack encoding is not available on this server")
+        if compression and compression not in FRAME_COMPRESSIONS:
+            raise ValueError(
+                f"Invalid compression: {compression}. Must be one of {', '.join(FRAME_COMPRESSIONS)}"
+            )
+        return cls(encoding, compression or None)
+    
+    def encode(self, message: Any) -> Frame:
+        """Serialize a message into a frame of this format."""
+        if self.encoding == "msgpack":
+            data = msgpack.packb(message)
+        elif self.compression:
+            data = dumps_bytes(message)
+        else:
+            return dumps(message)
+        
+        if self.compression == "deflate":
+            data = zlib.compress(data, DEFLATE_LEVEL)
+        return data
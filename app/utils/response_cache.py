@@ -0,0 +1,156 @@
+"""Versioned response cache with ETag / If-None-Match support for REST reads.
+
+The data version is the change seq. It is read from the database (one
+indexed MAX(seq) lookup) on every request, so a response never predates a
+committed write, even one whose change event has not arrived over the
+broadcast bus yet; bus events only drop stale entries early. Bodies are
+cached per (endpoint, filters, version) and dropped as soon as the version
+moves on. Built values can be shared the same way, e.g. the
+dashboard snapshot served both by ``/api/snapshot`` and WebSocket
+``initial_data``.
+"""
+import asyncio
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+from fastapi import Request, Response
+from app.config import config
+from app.utils import codec
+
+
+class ResponseCache:
+    """Serialized JSON bodies keyed by request and data version."""
+
+    def __init__(self, max_entries: int = config.RESPONSE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.version: Optional[int] = None
+        self._bodies: "OrderedDict[Tuple[Hashable, int], bytes]" = OrderedDict()
+        self._values: "OrderedDict[Tuple[Hashable, int], asyncio.Future]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def set_version(self, seq: Optional[int]):
+        """
+        Record the latest change seq.
+
+        Versions only move forward; ``None`` means the version is unknown
+        (e.g. events may have been missed) and forgets everything.
+        """
+        if seq is None:
+            self.version = None
+            self._bodies.clear()
+            self._values.clear()
+        elif self.version is None or seq > self.version:
+            self.version = seq
+            self._bodies.clear()
+            self._values.clear()
+
+    @staticmethod
+    def etag(version: int) -> str:
+        """ETag for a data version (weak, as compression may change the bytes)."""
+        return f'W/"{version}"'
+
+    async def current_version(self, load_version: Callable[[], Awaitable[int]]) -> int:
+        """The current version, loaded with ``load_version`` (the committed change seq)."""
+        self.set_version(await load_version())
+        return self.version
+
+    async def get(
+        self,
+        key: Hashable,
+        build: Callable[[], Awaitable[Any]],
+        load_version: Callable[[], Awaitable[int]]
+    ) -> Tuple[int, Any]:
+        """
+        Get the value ``build`` returns for ``key`` at the current version.
+
+        Concurrent callers share one build. Returns the version and the value,
+        which callers must not mutate.
+        """
+        version = await self.current_version(load_version)
+        cache_key = (key, version)
+        pending = self._values.get(cache_key)
+        if pending is None:
+            self.misses += 1
+            pending = asyncio.ensure_future(build())
+            self._values[cache_key] = pending
+            while len(self._values) > self.max_entries:
+                self._values.popitem(last=False)
+        else:
+            self.hits += 1
+            self._values.move_to_end(cache_key)
+
+        try:
+            return version, await asyncio.shield(pending)
+        except Exception:
+            if self._values.get(cache_key) is pending:
+                del self._values[cache_key]
+            raise
+
+    async def check(
+        self,
+        request: Request,
+        load_version: Callable[[], Awaitable[int]]
+    ) -> Tuple[int, Dict[str, str], Optional[Response]]:
+        """
+        Resolve the current version for a request.
+
+        Returns the version, the ETag headers to send and a 304 response
+        when the client's If-None-Match already matches (else None).
+        """
+        version = await self.current_version(load_version)
+        etag = self.etag(version)
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and etag in (tag.strip() for tag in if_none_match.split(",")):
+            self.not_modified += 1
+            return version, headers, Response(status_code=304, headers=headers)
+        return version, headers, None
+
+    async def respond(
+        self,
+        request: Request,
+        key: Hashable,
+        build: Callable[[], Awaitable[Any]],
+        load_version: Callable[[], Awaitable[int]]
+    ) -> Response:
+        """
+        Answer a read request from the cache.
+
+        Returns 304 when the client's If-None-Match matches the current
+        version, the cached body when there is one, and otherwise calls
+        ``build`` and caches its serialized result.
+        """
+        version, headers, not_modified = await self.check(request, load_version)
+        if not_modified:
+            return not_modified
+
+        body = self._bodies.get((key, version))
+        if body is None:
+            self.misses += 1
+            body = codec.dumps_bytes(await build())
+            # Only cache if no change arrived while building
+            if self.version == version:
+                self._bodies[(key, version)] = body
+                while len(self._bodies) > self.max_entries:
+                    self._bodies.popitem(last=False)
+        else:
+            self.hits += 1
+
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Current version and hit counters."""
+        return {
+            "version": self.version,
+            "cached": len(self._bodies),
+            "values": len(self._values),
+            "hits": self.hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified
+        }
+
+
+# Global response cache instance
+response_cache = ResponseCache()
@@ -0,0 +1,82 @@
+"""Memoized results for read-only MCP tools, keyed by the data version.
+
+Assistants often repeat the same status query several times in one turn.
+Results are cached per (tool, arguments, data version). Any commit, from
+this process or another one, changes the version and drops every entry.
+"""
+import functools
+import inspect
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+from app.config import config
+from app.utils import codec
+
+
+class ToolResultCache:
+    """LRU cache of tool results that is cleared whenever the data version moves."""
+
+    def __init__(
+        self,
+        load_version: Callable[[], Awaitable[Hashable]],
+        max_entries: int = config.MCP_TOOL_CACHE_SIZE
+    ):
+        self.load_version = load_version
+        self.max_entries = max_entries
+        self.version: Optional[Hashable] = None
+        self._results: "OrderedDict[Tuple[str, str], Any]" = OrderedDict()
+        self._tools: Dict[str, Dict[str, int]] = {}
+        self.invalidations = 0
+
+    def cached(self, func: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+        """
+        Decorate a read-only tool so repeated calls are served from memory.
+
+        Arguments are normalized by binding them to the tool's signature
+        (defaults applied), so positional, keyword and omitted-default calls
+        share an entry.
+        """
+        signature = inspect.signature(func)
+        stats = self._tools.setdefault(func.__name__, {"hits": 0, "misses": 0})
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = (func.__name__, codec.dumps(bound.arguments))
+
+            version = await self.load_version()
+            if version != self.version:
+                if self._results:
+                    self.invalidations += 1
+                self._results.clear()
+                self.version = version
+
+            if key in self._results:
+                stats["hits"] += 1
+                self._results.move_to_end(key)
+                return self._results[key]
+
+            stats["misses"] += 1
+            result = await func(*args, **kwargs)
+            # Skip caching if a newer version was seen while the tool ran
+            if self.version == version:
+                self._results[key] = result
+                while len(self._results) > self.max_entries:
+                    self._results.popitem(last=False)
+            return result
+
+        return wrapper
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Cache size plus hit and miss counters, in total and per tool."""
+        hits = sum(stats["hits"] for stats in self._tools.values())
+        misses = sum(stats["misses"] for stats in self._tools.values())
+        return {
+            "cached": len(self._results),
+            "max_entries": self.max_entries,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / (hits + misses), 3) if hits + misses else None,
+            "invalidations": self.invalidations,
+            "tools": {name: dict(stats) for name, stats in self._tools.items()}
+        }
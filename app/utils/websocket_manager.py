@@ -1,49 +1,456 @@
 """WebSocket connection manager for real-time updates."""
 import asyncio
-import json
-from typing import List, Dict, Any
+import itertools
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Deque, Dict, Iterable, List, Any, Optional, Set, Tuple
 from fastapi import WebSocket
 from datetime import datetime
+from app.config import config
+from app.utils.codec import Frame, FrameFormat
+
+
+QUEUE_POLICIES = ("drop", "coalesce", "disconnect")
+
+# Close code sent to evicted slow consumers (policy violation)
+SLOW_CONSUMER_CLOSE_CODE = 1008
+
+
+# (kind, value) topic keys: ("room", "bedroom"), ("type", "light"),
+# ("device", "garage_door"), or ALL_TOPIC for unfiltered clients
+Topic = Tuple[str, Optional[str]]
+ALL_TOPIC: Topic = ("*", None)
+
+
+class Subscription:
+    """
+    Which devices a client wants to hear about.
+    
+    A device matches when its ID is listed in ``device_ids``, or when it
+    passes the ``rooms`` and ``types`` filters (an empty filter allows
+    anything). With no filters at all the client receives everything.
+    """
+    
+    def __init__(
+        self,
+        rooms: Optional[Iterable[str]] = None,
+        types: Optional[Iterable[str]] = None,
+        device_ids: Optional[Iterable[str]] = None
+    ):
+        self.rooms: Set[str] = set(rooms or ())
+        self.types: Set[str] = set(types or ())
+        self.device_ids: Set[str] = set(device_ids or ())
+    
+    @classmethod
+    def from_message(cls, message: Dict[str, Any]) -> "Subscription":
+        """Build a subscription from a ``subscribe`` message (or query params)."""
+        filters = {}
+        for key in ("rooms", "types", "device_ids"):
+            value = message.get(key) or []
+            if isinstance(value, str):
+                value = [v for v in value.split(",") if v]
+            if not isinstance(value, list) or not all(isinstance(v, str) for v in value):
+                raise ValueError(f"'{key}' must be a list of strings")
+            filters[key] = value
+        return cls(**filters)
+    
+    @property
+    def is_everything(self) -> bool:
+        """Whether the client receives all devices."""
+        return not (self.rooms or self.types or self.device_ids)
+    
+    def matches(self, device: Dict[str, Any]) -> bool:
+        """Whether a device row is covered by this subscription."""
+        if self.is_everything or device["id"] in self.device_ids:
+            return True
+        if not (self.rooms or self.types):
+            return False
+        return (
+            (not self.rooms or device.get("room") in self.rooms)
+            and (not self.types or device.get("type") in self.types)
+        )
+    
+    def topics(self) -> List[Topic]:
+        """Index keys under which the client is registered."""
+        if self.is_everything:
+            return [ALL_TOPIC]
+        topics: List[Topic] = [("device", device_id) for device_id in self.device_ids]
+        # Rooms are the narrower key; types alone are indexed only without rooms
+        if self.rooms:
+            topics.extend(("room", room) for room in self.rooms)
+        else:
+            topics.extend(("type", device_type) for device_type in self.types)
+        return topics
+    
+    def key(self) -> Tuple[Tuple[str, ...], ...]:
+        """Hashable form of the filters (for snapshot caching)."""
+        return (tuple(sorted(self.rooms)), tuple(sorted(self.types)), tuple(sorted(self.device_ids)))
+    
+    def to_dict(self) -> Dict[str, List[str]]:
+        """Filters as sorted lists (for the ``subscribed`` reply)."""
+        return {
+            "rooms": sorted(self.rooms),
+            "types": sorted(self.types),
+            "device_ids": sorted(self.device_ids)
+        }
+
+
+class ClientConnection:
+    """
+    One WebSocket client with a bounded outbound queue and its own writer task.
+    
+    Frames are pre-serialized in the client's ``frame_format``; the writer
+    task is the only coroutine that sends on the socket, so a slow client
+    only ever delays itself.
+    """
+    
+    def __init__(
+        self,
+        client_id: int,
+        websocket: WebSocket,
+        queue_size: int,
+        frame_format: FrameFormat = FrameFormat()
+    ):
+        self.client_id = client_id
+        self.websocket = websocket
+        self.frame_format = frame_format
+        self.queue: "asyncio.Queue[tuple]" = asyncio.Queue(maxsize=queue_size)
+        self.connected_at = datetime.now().isoformat()
+        self.frames_sent = 0
+        self.frames_dropped = 0
+        self.overflows = 0
+        self.last_lag_ms = 0.0
+        self.max_lag_ms = 0.0
+        self.writer: Optional[asyncio.Task] = None
+        self.subscription = Subscription()
+        # Frames broadcast while a snapshot or replay is being prepared
+        self.held: Optional[List[Frame]] = None
+    
+    def put(self, frame: Frame):
+        """Queue a frame, stamped with the time it was queued."""
+        self.queue.put_nowait((time.perf_counter(), frame))
+    
+    def clear(self) -> int:
+        """Discard all queued frames. Returns how many were discarded."""
+        discarded = 0
+        while not self.queue.empty():
+            self.queue.get_nowait()
+            discarded += 1
+        return discarded
+    
+    @property
+    def lag_ms(self) -> float:
+        """Age of the oldest queued frame (0 when the client is caught up)."""
+        if self.queue.empty():
+            return 0.0
+        queued_at, _ = self.queue._queue[0]
+        return (time.perf_counter() - queued_at) * 1000
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Queue depth, lag and counters for this client."""
+        client = self.websocket.client
+        return {
+            "id": self.client_id,
+            "address": f"{client.host}:{client.port}" if client else None,
+            "connected_at": self.connected_at,
+            "encoding": self.frame_format.encoding,
+            "compression": self.frame_format.compression,
+            "queue_depth": self.queue.qsize(),
+            "lag_ms": round(self.lag_ms, 2),
+            "last_lag_ms": round(self.last_lag_ms, 2),
+            "max_lag_ms": round(self.max_lag_ms, 2),
+            "frames_sent": self.frames_sent,
+            "frames_dropped": self.frames_dropped,
+            "overflows": self.overflows,
+            "subscription": self.subscription.to_dict()
+        }
 
 
 class WebSocketManager:
-    """Manages WebSocket connections and broadcasts."""
+    """
+    Manages WebSocket connections and broadcasts.
     
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
-        self._update_flag = asyncio.Event()
-        self._update_data: Dict[str, Any] = {}
+    A broadcast serializes the message once and enqueues the frame on every
+    client's bounded queue without awaiting any socket. When a queue is full
+    the overflow policy decides what happens:
     
-    async def connect(self, websocket: WebSocket):
+    - ``drop``: discard the oldest queued frame
+    - ``coalesce``: discard everything queued and send one ``full_refresh``
+      so the client re-fetches the current state
+    - ``disconnect``: evict the client immediately
+    
+    Clients that overflow ``max_overflows`` times, or whose socket does not
+    accept a frame within ``send_timeout`` seconds, are evicted as well.
+    
+    Clients may subscribe to rooms, device types or device IDs. An index from
+    topic to subscribers routes each changed device to the interested clients
+    only, so a delta costs O(changed devices x interested subscribers).
+    
+    Device deltas are coalesced: changes arriving within ``coalesce_window``
+    seconds of each other are merged per device (last writer wins) and sent
+    as one frame, at most ``coalesce_max_delay`` seconds after the first.
+    Changes to ``bypass_types`` (locks, garage doors) flush immediately.
+    
+    Every message is serialized once per frame format in use and the frame is
+    shared by all clients of that format. ``initial_data`` snapshots are
+    cached per data version, subscription and format, so a reconnect storm
+    loads and serializes each distinct snapshot once.
+    
+    Broadcasts carry the change seq. The last ``replay_size`` deltas and mode
+    changes are kept in a ring buffer so a reconnecting client that sends its
+    last seen seq gets only what it missed (see ``resume``).
+    """
+    
+    def __init__(
+        self,
+        queue_size: int = config.WS_SEND_QUEUE_SIZE,
+        policy: str = config.WS_QUEUE_POLICY,
+        max_overflows: int = config.WS_MAX_OVERFLOWS,
+        send_timeout: float = config.WS_SEND_TIMEOUT,
+        coalesce_window: float = config.WS_COALESCE_WINDOW,
+        coalesce_max_delay: float = config.WS_COALESCE_MAX_DELAY,
+        bypass_types: Iterable[str] = config.WS_COALESCE_BYPASS_TYPES,
+        replay_size: int = config.WS_REPLAY_BUFFER_SIZE
+    ):
+        if policy not in QUEUE_POLICIES:
+            raise ValueError(
+                f"Invalid WebSocket queue policy: {policy}. Must be one of {', '.join(QUEUE_POLICIES)}"
+            )
+        self.queue_size = queue_size
+        self.policy = policy
+        self.max_overflows = max_overflows
+        self.send_timeout = send_timeout
+        self.active_connections: Dict[WebSocket, ClientConnection] = {}
+        self._topics: Dict[Topic, Set[ClientConnection]] = {}
+        self._client_ids = itertools.count(1)
+        self._evictions = 0
+        
+        # Coalescing state: pending device rows by ID, deleted IDs, newest stats/seq
+        self.coalesce_window = coalesce_window
+        self.coalesce_max_delay = max(coalesce_max_delay, coalesce_window)
+        self.bypass_types = set(bypass_types)
+        self._pending_devices: Dict[str, Dict[str, Any]] = {}
+        self._pending_deleted: Set[str] = set()
+        self._pending_stats: Optional[Dict[str, Any]] = None
+        self._pending_seq: Optional[int] = None
+        self._first_pending_at = 0.0
+        self._last_pending_at = 0.0
+        self._flush_task: Optional[asyncio.Task] = None
+        self._updates_received = 0
+        self._updates_merged = 0
+        self._delta_flushes = 0
+        
+        # initial_data cache for the current data version
+        self._snapshot_version: Optional[int] = None
+        self._snapshot_payloads: "OrderedDict[tuple, asyncio.Future]" = OrderedDict()
+        self._snapshot_frames: "OrderedDict[tuple, Frame]" = OrderedDict()
+        self._snapshot_hits = 0
+        self._snapshot_misses = 0
+        
+        # Replay buffer: every change after _replay_floor up to _replay_seq
+        self._replay: Deque[Dict[str, Any]] = deque(maxlen=replay_size)
+        self._replay_floor: Optional[int] = None
+        self._replay_seq: Optional[int] = None
+        self._resumes = {"buffer": 0, "changes": 0, "snapshot": 0}
+    
+    async def connect(
+        self,
+        websocket: WebSocket,
+        subscription: Optional[Subscription] = None,
+        frame_format: FrameFormat = FrameFormat()
+    ):
         """Accept and register a new WebSocket connection."""
         await websocket.accept()
-        self.active_connections.append(websocket)
+        client = ClientConnection(next(self._client_ids), websocket, self.queue_size, frame_format)
+        client.writer = asyncio.create_task(self._write_loop(client))
+        self.active_connections[websocket] = client
+        self._index(client, subscription or Subscription())
         print(f"WebSocket connected. Total connections: {len(self.active_connections)}")
     
     def disconnect(self, websocket: WebSocket):
-        """Unregister a WebSocket connection."""
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
-            print(f"WebSocket disconnected. Total connections: {len(self.active_connections)}")
+        """Unregister a WebSocket connection and stop its writer."""
+        client = self.active_connections.pop(websocket, None)
+        if client is None:
+            return
+        self._unindex(client)
+        if client.writer and client.writer is not asyncio.current_task():
+            client.writer.cancel()
+        client.clear()
+        print(f"WebSocket disconnected. Total connections: {len(self.active_connections)}")
     
-    async def broadcast(self, message: Dict[str, Any]):
-        """Broadcast a message to all connected clients."""
-        if not self.active_connections:
+    def subscribe(self, websocket: WebSocket, subscription: Subscription):
+        """Replace a client's subscription."""
+        client = self.active_connections.get(websocket)
+        if client:
+            self._unindex(client)
+            self._index(client, subscription)
+    
+    def get_subscription(self, websocket: WebSocket) -> Subscription:
+        """A client's current subscription."""
+        client = self.active_connections.get(websocket)
+        return client.subscription if client else Subscription()
+    
+    async def send(self, websocket: WebSocket, message: Dict[str, Any]):
+        """Queue a message for a single client."""
+        client = self.active_connections.get(websocket)
+        if client:
+            self._enqueue(client, client.frame_format.encode(message))
+    
+    async def send_snapshot(
+        self,
+        websocket: WebSocket,
+        version: int,
+        load: Callable[[Subscription], Awaitable[Dict[str, Any]]]
+    ):
+        """
+        Queue an ``initial_data`` snapshot for a client's subscription.
+        
+        ``version`` identifies the data (the change seq of the last event
+        applied), ``load`` returns the snapshot fields (``devices``, ``stats``,
+        ...) for a subscription. Concurrent requests for the same snapshot
+        share one load and one serialization per format.
+        """
+        client = self.active_connections.get(websocket)
+        if client is None:
             return
         
-        message_text = json.dumps(message)
-        disconnected = []
+        async with self._holding(client) as out:
+            out.append(await self._snapshot_frame(client, version, load))
+    
+    async def resume(
+        self,
+        websocket: WebSocket,
+        last_seq: int,
+        load_delta: Callable[[int], Awaitable[Optional[Dict[str, Any]]]],
+        load_seq: Callable[[], Awaitable[int]]
+    ) -> bool:
+        """
+        Send a reconnecting client only what it missed since ``last_seq``.
         
-        for connection in self.active_connections:
+        Served from the replay buffer when it reaches back far enough,
+        otherwise from ``load_delta`` (``Database.get_changes_delta``), which
+        survives server restarts. Returns False when the gap is too old or
+        unknown, or when ``last_seq`` is ahead of the committed seq
+        (``load_seq``), and the caller should send a snapshot instead.
+        """
+        client = self.active_connections.get(websocket)
+        if client is None:
+            return True
+        if last_seq > await load_seq() or (
+            self._replay_seq is not None and last_seq > self._replay_seq
+        ):
+            # The client saw seqs this database never produced (e.g. reset),
+            # or ones this worker has not applied yet
+            self._resumes["snapshot"] += 1
+            return False
+        
+        if self._replay_floor is not None and self._replay_floor <= last_seq:
+            entries = [entry for entry in self._replay if entry["seq"] > last_seq]
+            async with self._holding(client) as out:
+                out.extend(self._replay_frames(client, last_seq, entries, "buffer"))
+            self._resumes["buffer"] += 1
+            return True
+        
+        async with self._holding(client) as out:
+            delta = await load_delta(last_seq)
+            if delta is not None and not delta["complete"]:
+                self._resumes["snapshot"] += 1
+                return False
+            out.extend(self._replay_frames(client, last_seq, [delta] if delta else [], "changes"))
+        self._resumes["changes"] += 1
+        return True
+    
+    def reset_replay(self, seq: Optional[int]):
+        """Restart the replay buffer at ``seq`` (None when the position is unknown)."""
+        self._replay.clear()
+        self._replay_floor = seq
+        self._replay_seq = seq
+    
+    async def _snapshot_frame(
+        self,
+        client: ClientConnection,
+        version: int,
+        load: Callable[[Subscription], Awaitable[Dict[str, Any]]]
+    ) -> Frame:
+        """Cached ``initial_data`` frame for a client's subscription and format."""
+        if version != self._snapshot_version:
+            self._snapshot_version = version
+            self._snapshot_payloads.clear()
+            self._snapshot_frames.clear()
+        
+        subscription_key = client.subscription.key()
+        frame_key = (subscription_key, client.frame_format)
+        frame = self._snapshot_frames.get(frame_key)
+        if frame is None:
+            self._snapshot_misses += 1
+            pending = self._snapshot_payloads.get(subscription_key)
+            if pending is None:
+                pending = asyncio.ensure_future(load(client.subscription))
+                self._cache_put(self._snapshot_payloads, subscription_key, pending)
             try:
-                await connection.send_text(message_text)
-            except Exception as e:
-                print(f"Error broadcasting to client: {e}")
-                disconnected.append(connection)
+                payload = await asyncio.shield(pending)
+            except Exception:
+                self._snapshot_payloads.pop(subscription_key, None)
+                raise
+            frame = client.frame_format.encode({
+                "type": "initial_data",
+                **payload,
+                "seq": version
+            })
+            if version == self._snapshot_version:
+                self._cache_put(self._snapshot_frames, frame_key, frame)
+        else:
+            self._snapshot_hits += 1
+            self._snapshot_frames.move_to_end(frame_key)
+        return frame
+    
+    async def broadcast(self, message: Dict[str, Any]):
+        """Broadcast a message to all connected clients."""
+        if not self.active_connections:
+            return
         
-        # Remove disconnected clients
-        for connection in disconnected:
-            self.disconnect(connection)
+        # Serialize once per format; enqueueing never waits on a socket
+        frames: Dict[FrameFormat, Frame] = {}
+        for client in list(self.active_connections.values()):
+            frame = frames.get(client.frame_format)
+            if frame is None:
+                frame = frames[client.frame_format] = client.frame_format.encode(message)
+            self._enqueue(client, frame)
+    
+    def get_metrics(self) -> Dict[str, Any]:
+        """Per-client queue depth and lag plus overall fan-out counters."""
+        clients = [client.get_stats() for client in self.active_connections.values()]
+        return {
+            "connections": len(clients),
+            "policy": self.policy,
+            "queue_size": self.queue_size,
+            "evictions": self._evictions,
+            "max_queue_depth": max((c["queue_depth"] for c in clients), default=0),
+            "max_lag_ms": max((c["lag_ms"] for c in clients), default=0.0),
+            "coalescing": {
+                "window_ms": self.coalesce_window * 1000,
+                "max_delay_ms": self.coalesce_max_delay * 1000,
+                "bypass_types": sorted(self.bypass_types),
+                "updates_received": self._updates_received,
+                "updates_merged": self._updates_merged,
+                "flushes": self._delta_flushes,
+                "pending": len(self._pending_devices) + len(self._pending_deleted)
+            },
+            "replay": {
+                "buffered": len(self._replay),
+                "floor_seq": self._replay_floor,
+                "seq": self._replay_seq,
+                "resumes": dict(self._resumes)
+            },
+            "snapshots": {
+                "version": self._snapshot_version,
+                "cached": len(self._snapshot_frames),
+                "hits": self._snapshot_hits,
+                "misses": self._snapshot_misses
+            },
+            "clients": clients
+        }
     
     async def broadcast_device_update(
         self,
@@ -65,37 +472,341 @@ class WebSocketManager:
         }
         await self.broadcast(message)
     
-    async def broadcast_mode_change(self, mode: str):
+    async def broadcast_devices_delta(
+        self,
+        devices: List[Dict[str, Any]],
+        deleted: List[str],
+        stats: Dict[str, Any],
+        seq: int
+    ):
+        """
+        Queue changed device rows and the updated stats for subscribers.
+        
+        Rows are merged into the pending delta and sent when the coalescing
+        window closes, or right away for bypass types or a zero window.
+        """
+        if not self.active_connections:
+            # Nobody will receive this, so the buffer can no longer replay it
+            self.reset_replay(seq)
+            return
+        
+        self._updates_received += len(devices) + len(deleted)
+        for device in devices:
+            if device["id"] in self._pending_devices:
+                self._updates_merged += 1
+            self._pending_devices[device["id"]] = device
+            self._pending_deleted.discard(device["id"])
+        for device_id in deleted:
+            if self._pending_devices.pop(device_id, None) is not None:
+                self._updates_merged += 1
+            self._pending_deleted.add(device_id)
+        self._pending_stats = stats
+        self._pending_seq = seq
+        
+        now = time.perf_counter()
+        if self._flush_task is None:
+            self._first_pending_at = now
+        self._last_pending_at = now
+        
+        if self.coalesce_window <= 0 or any(
+            device.get("type") in self.bypass_types for device in devices
+        ):
+            self.flush()
+        elif self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later())
+    
+    def flush(self):
+        """Send the pending delta now."""
+        if self._flush_task is not None:
+            if self._flush_task is not asyncio.current_task():
+                self._flush_task.cancel()
+            self._flush_task = None
+        
+        if not (self._pending_devices or self._pending_deleted):
+            return
+        devices = list(self._pending_devices.values())
+        deleted = sorted(self._pending_deleted)
+        stats, seq = self._pending_stats, self._pending_seq
+        self._discard_pending()
+        
+        self._delta_flushes += 1
+        self._record({"seq": seq, "devices": devices, "deleted": deleted, "mode": None, "stats": stats})
+        self._send_delta(devices, deleted, stats, seq)
+    
+    async def broadcast_mode_change(
+        self,
+        mode: str,
+        stats: Optional[Dict[str, Any]] = None,
+        seq: Optional[int] = None
+    ):
         """Broadcast a home mode change."""
+        # Keep ordering: device changes that came first are sent first
+        self.flush()
+        if seq is not None:
+            self._record({"seq": seq, "devices": [], "deleted": [], "mode": mode, "stats": stats})
         message = {
             "type": "mode_change",
             "mode": mode,
+            "stats": stats,
+            "seq": seq,
             "timestamp": datetime.now().isoformat()
         }
         await self.broadcast(message)
     
-    async def broadcast_full_refresh(self):
+    async def broadcast_full_refresh(self, seq: Optional[int] = None):
         """Broadcast a full refresh signal."""
+        # Clients re-fetch everything, so pending deltas are moot
+        self._discard_pending()
+        self.reset_replay(seq)
         message = {
             "type": "full_refresh",
+            "seq": seq,
             "timestamp": datetime.now().isoformat()
         }
         await self.broadcast(message)
     
-    def signal_update(self, update_data: Dict[str, Any] = None):
-        """Signal that an update has occurred (for polling mechanism)."""
-        self._update_data = update_data or {}
-        self._update_flag.set()
+    async def _flush_later(self):
+        """Flush once updates pause for a window, or the max delay is reached."""
+        while True:
+            deadline = min(
+                self._last_pending_at + self.coalesce_window,
+                self._first_pending_at + self.coalesce_max_delay
+            )
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            await asyncio.sleep(remaining)
+        self.flush()
     
-    async def wait_for_update(self, timeout: float = None):
-        """Wait for an update signal (for polling mechanism)."""
+    def _discard_pending(self):
+        """Forget the pending delta."""
+        if self._flush_task is not None and self._flush_task is not asyncio.current_task():
+            self._flush_task.cancel()
+        self._flush_task = None
+        self._pending_devices = {}
+        self._pending_deleted = set()
+        self._pending_stats = None
+        self._pending_seq = None
+    
+    def _send_delta(
+        self,
+        devices: List[Dict[str, Any]],
+        deleted: List[str],
+        stats: Optional[Dict[str, Any]],
+        seq: Optional[int]
+    ):
+        """
+        Send a delta to subscribers.
+        
+        Each client only receives the devices it subscribed to; clients with
+        the same set of matches share one serialized frame. Deleted IDs no
+        longer have a room or type to route on and go to every client.
+        """
+        routed: Dict[ClientConnection, List[Dict[str, Any]]] = {}
+        for device in devices:
+            for client in self._subscribers(device):
+                routed.setdefault(client, []).append(device)
+        if deleted:
+            for client in self.active_connections.values():
+                routed.setdefault(client, [])
+        
+        frames: Dict[Tuple[FrameFormat, Tuple[str, ...]], Frame] = {}
+        timestamp = datetime.now().isoformat()
+        for client, client_devices in routed.items():
+            key = (client.frame_format, tuple(device["id"] for device in client_devices))
+            frame = frames.get(key)
+            if frame is None:
+                frame = frames[key] = client.frame_format.encode({
+                    "type": "devices_delta",
+                    "devices": client_devices,
+                    "deleted": deleted,
+                    "stats": stats,
+                    "seq": seq,
+                    "timestamp": timestamp
+                })
+            self._enqueue(client, frame)
+    
+    def _index(self, client: ClientConnection, subscription: Subscription):
+        """Register a client under its subscription's topics."""
+        client.subscription = subscription
+        for topic in subscription.topics():
+            self._topics.setdefault(topic, set()).add(client)
+    
+    def _unindex(self, client: ClientConnection):
+        """Remove a client from the topic index."""
+        for topic in client.subscription.topics():
+            subscribers = self._topics.get(topic)
+            if subscribers is not None:
+                subscribers.discard(client)
+                if not subscribers:
+                    del self._topics[topic]
+    
+    def _subscribers(self, device: Dict[str, Any]) -> Set[ClientConnection]:
+        """Clients subscribed to a device, found through the topic index."""
+        candidates: Set[ClientConnection] = set()
+        for topic in (
+            ALL_TOPIC,
+            ("device", device["id"]),
+            ("room", device.get("room")),
+            ("type", device.get("type"))
+        ):
+            candidates.update(self._topics.get(topic, ()))
+        # Room and type filters combine, so confirm the full match
+        return {client for client in candidates if client.subscription.matches(device)}
+    
+    def _record(self, entry: Dict[str, Any]):
+        """Append a broadcast to the replay buffer."""
+        if entry["seq"] is None:
+            return
+        if self._replay_seq is None:
+            # Without a known starting point nothing can be replayed yet
+            self.reset_replay(entry["seq"])
+            return
+        if len(self._replay) == self._replay.maxlen:
+            self._replay_floor = self._replay[0]["seq"]
+        self._replay.append(entry)
+        self._replay_seq = entry["seq"]
+    
+    def _replay_frames(
+        self,
+        client: ClientConnection,
+        last_seq: int,
+        entries: List[Dict[str, Any]],
+        source: str
+    ) -> List[Frame]:
+        """Merge missed entries into one filtered delta for a client."""
+        devices: Dict[str, Dict[str, Any]] = {}
+        deleted: Set[str] = set()
+        stats, mode = None, None
+        seq = last_seq
+        for entry in entries:
+            for device in entry["devices"]:
+                devices[device["id"]] = device
+                deleted.discard(device["id"])
+            for device_id in entry["deleted"]:
+                devices.pop(device_id, None)
+                deleted.add(device_id)
+            stats = entry["stats"] or stats
+            mode = entry["mode"] or mode
+            seq = max(seq, entry["seq"])
+        
+        encode = client.frame_format.encode
+        frames = [encode({"type": "resumed", "seq": seq, "last_seq": last_seq, "source": source})]
+        matched = [device for device in devices.values() if client.subscription.matches(device)]
+        if matched or deleted:
+            frames.append(encode({
+                "type": "devices_delta",
+                "devices": matched,
+                "deleted": sorted(deleted),
+                "stats": stats,
+                "seq": seq,
+                "replayed": True,
+                "timestamp": datetime.now().isoformat()
+            }))
+        if mode:
+            frames.append(encode({
+                "type": "mode_change",
+                "mode": mode,
+                "stats": stats,
+                "seq": seq,
+                "replayed": True,
+                "timestamp": datetime.now().isoformat()
+            }))
+        return frames
+    
+    @asynccontextmanager
+    async def _holding(self, client: ClientConnection):
+        """
+        Hold broadcasts to a client while its snapshot or replay is built.
+        
+        Frames appended to the yielded list are queued first, then the held
+        broadcasts, so nothing older can overwrite what was broadcast later.
+        """
+        out: List[Frame] = []
+        client.held = []
         try:
-            await asyncio.wait_for(self._update_flag.wait(), timeout=timeout)
-            self._update_flag.clear()
-            return self._update_data
-        except asyncio.TimeoutError:
-            return None
-
+            yield out
+        finally:
+            held, client.held = client.held, None
+            if client.websocket in self.active_connections:
+                for frame in out + held:
+                    self._enqueue(client, frame)
+    
+    def _cache_put(self, cache: OrderedDict, key: tuple, value: Any):
+        """Insert into an LRU snapshot cache, evicting the oldest entries."""
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > config.WS_SNAPSHOT_CACHE_SIZE:
+            cache.popitem(last=False)
+    
+    def _enqueue(self, client: ClientConnection, frame: Frame):
+        """Put a frame on a client's queue, applying the overflow policy."""
+        if client.held is not None:
+            client.held.append(frame)
+            return
+        if not client.queue.full():
+            client.put(frame)
+            return
+        
+        client.overflows += 1
+        if self.policy == "disconnect" or (
+            self.max_overflows and client.overflows >= self.max_overflows
+        ):
+            client.frames_dropped += client.queue.qsize() + 1
+            self._evict(client, "slow consumer")
+            return
+        
+        if self.policy == "coalesce":
+            # The queued deltas are stale anyway; one refresh replaces them all
+            client.frames_dropped += client.clear() + 1
+            client.put(client.frame_format.encode({
+                "type": "full_refresh",
+                "timestamp": datetime.now().isoformat()
+            }))
+        else:
+            client.queue.get_nowait()
+            client.frames_dropped += 1
+            client.put(frame)
+    
+    def _evict(self, client: ClientConnection, reason: str):
+        """Disconnect a client and close its socket in the background."""
+        if client.websocket not in self.active_connections:
+            return
+        self._evictions += 1
+        print(f"Evicting WebSocket client {client.client_id}: {reason}")
+        self.disconnect(client.websocket)
+        asyncio.create_task(self._close(client.websocket, reason))
+    
+    async def _close(self, websocket: WebSocket, reason: str):
+        """Close a socket without letting a stalled peer block us."""
+        try:
+            await asyncio.wait_for(
+                websocket.close(code=SLOW_CONSUMER_CLOSE_CODE, reason=reason),
+                timeout=self.send_timeout
+            )
+        except Exception:
+            pass
+    
+    async def _write_loop(self, client: ClientConnection):
+        """Send queued frames to one client until it disconnects."""
+        while True:
+            queued_at, frame = await client.queue.get()
+            send = client.websocket.send_text if isinstance(frame, str) else client.websocket.send_bytes
+            try:
+                await asyncio.wait_for(send(frame), timeout=self.send_timeout)
+            except asyncio.CancelledError:
+                raise
+            except asyncio.TimeoutError:
+                self._evict(client, f"send timed out after {self.send_timeout}s")
+                return
+            except Exception as e:
+                print(f"Error sending to client {client.client_id}: {e}")
+                self.disconnect(client.websocket)
+                return
+            
+            client.frames_sent += 1
+            client.last_lag_ms = (time.perf_counter() - queued_at) * 1000
+            client.max_lag_ms = max(client.max_lag_ms, client.last_lag_ms)
 
 # Global WebSocket manager instance
 ws_manager = WebSocketManager()
@@ -1,4 +1,4 @@
-import { useState, useEffect } from 'react'
+import { useState } from 'react'
 import './App.css'
 import Dashboard from './components/Dashboard'
 import useWebSocket from './hooks/useWebSocket'
@@ -12,44 +12,10 @@ function App() {
   const [stats, setStats] = useState(null)
   const [loading, setLoading] = useState(true)
 
-  // Connect to WebSocket
-  const { lastMessage, isConnected } = useWebSocket(WS_URL)
-
-  // Fetch initial data
-  useEffect(() => {
-    fetchDevices()
-    fetchRooms()
-    fetchStats()
-  }, [])
-
-  // Handle WebSocket updates
-  useEffect(() => {
-    if (lastMessage) {
-      handleRealtimeUpdate(lastMessage)
-    }
-  }, [lastMessage])
-
-  const fetchDevices = async () => {
-    try {
-      const response = await fetch(`${API_URL}/api/devices`)
-      const data = await response.json()
-      setDevices(data)
-      setLoading(false)
-    } catch (error) {
-      console.error('Error fetching devices:', error)
-      setLoading(false)
-    }
-  }
-
-  const fetchRooms = async () => {
-    try {
-      const response = await fetch(`${API_URL}/api/rooms`)
-      const data = await response.json()
-      setRooms(data)
-    } catch (error) {
-      console.error('Error fetching rooms:', error)
-    }
-  }
+  // Connect to WebSocket; every message is applied as it arrives. The
+  // initial data arrives over the socket too (initial_data), in order with
+  // the deltas that follow it, so there is no separate REST fetch to race them
+  const { isConnected, sendMessage } = useWebSocket(WS_URL, (update) => handleRealtimeUpdate(update))
 
   const fetchStats = async () => {
     try {
@@ -93,14 +59,48 @@ function App() {
       
       // Refresh stats
       fetchStats()
+    } else if (update.type === 'initial_data') {
+      // Fresh snapshot (first connect, or a reconnect too old to replay)
+      setDevices(update.devices)
+      setRooms(update.rooms)
+      setStats(update.stats)
+      setLoading(false)
+    } else if (update.type === 'devices_delta') {
+      // Merge only the changed rows; stats arrive with the delta
+      const changed = new Map(update.devices.map(device => [device.id, device]))
+      const deleted = new Set(update.deleted)
+      
+      setDevices(prevDevices => {
+        const known = new Set(prevDevices.map(device => device.id))
+        const merged = prevDevices
+          .filter(device => !deleted.has(device.id))
+          .map(device => changed.get(device.id) || device)
+        // Changed rows not seen before are new devices
+        const added = update.devices.filter(device => !known.has(device.id))
+        return [...merged, ...added]
+      })
+      
+      setRooms(prevRooms => {
+        const known = new Set(prevRooms)
+        const added = update.devices
+          .map(device => device.room)
+          .filter(room => room && !known.has(room))
+        return added.length ? [...new Set([...prevRooms, ...added])].sort() : prevRooms
+      })
+      
+      setStats(update.stats)
     } else if (update.type === 'full_refresh') {
-      // Full refresh after mode change
-      fetchDevices()
-      fetchStats()
+      // Too many changes for a delta; re-subscribing makes the server send
+      // a fresh initial_data on the socket, ordered with later deltas
+      sendMessage({ type: 'subscribe' })
     } else if (update.type === 'mode_change') {
       // Mode changed
       console.log('Mode changed:', update.mode)
-      fetchStats()
+      if (update.stats) {
+        setStats(update.stats)
+      } else {
+        fetchStats()
+      }
     }
   }
 
@@ -1,14 +1,24 @@
 import { useState, useEffect, useRef, useCallback } from 'react'
 
-function useWebSocket(url) {
+// onMessage is called for every message; lastMessage alone can drop
+// messages that arrive back to back (e.g. resumed + devices_delta)
+function useWebSocket(url, onMessage) {
   const [lastMessage, setLastMessage] = useState(null)
   const [isConnected, setIsConnected] = useState(false)
   const ws = useRef(null)
   const reconnectTimeout = useRef(null)
+  // Last change seq received; sent on reconnect so the server replays only what we missed
+  const lastSeq = useRef(null)
+  const onMessageRef = useRef(onMessage)
+  onMessageRef.current = onMessage
 
   const connect = useCallback(() => {
     try {
-      ws.current = new WebSocket(url)
+      const target = new URL(url)
+      if (lastSeq.current !== null) {
+        target.searchParams.set('last_seq', lastSeq.current)
+      }
+      ws.current = new WebSocket(target.toString())
 
       ws.current.onopen = () => {
         console.log('✅ WebSocket connected')
@@ -18,7 +28,13 @@ function useWebSocket(url) {
       ws.current.onmessage = (event) => {
         const data = JSON.parse(event.data)
         console.log('📨 WebSocket message:', data)
+        if (typeof data.seq === 'number') {
+          lastSeq.current = data.seq
+        }
         setLastMessage(data)
+        if (onMessageRef.current) {
+          onMessageRef.current(data)
+        }
       }
 
       ws.current.onerror = (error) => {
@@ -40,6 +56,13 @@ function useWebSocket(url) {
     }
   }, [url])
 
+  // Send a message, e.g. { type: 'subscribe', rooms: ['bedroom'] }
+  const sendMessage = useCallback((message) => {
+    if (ws.current && ws.current.readyState === WebSocket.OPEN) {
+      ws.current.send(JSON.stringify(message))
+    }
+  }, [])
+
   useEffect(() => {
     connect()
 
@@ -54,7 +77,7 @@ function useWebSocket(url) {
     }
   }, [connect])
 
-  return { lastMessage, isConnected }
+  return { lastMessage, isConnected, sendMessage }
 }
 
 export default useWebSocket
\ No newline at end of file
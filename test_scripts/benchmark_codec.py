@@ -0,0 +1,81 @@
+"""Micro-benchmark: stdlib json vs. the app codec on a 10k-device snapshot."""
+import json
+import sys
+import time
+from pathlib import Path
+
+# Set UTF-8 encoding for Windows console
+if sys.platform == "win32":
+    import codecs
+    sys.stdout = codecs.getwriter("utf-8")(sys.stdout.detach())
+    sys.stderr = codecs.getwriter("utf-8")(sys.stderr.detach())
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.utils import codec
+
+
+DEVICE_COUNT = 10_000
+ROUNDS = 20
+
+
+def build_snapshot():
+    """Build a device list shaped like /api/devices on a large install."""
+    types = ["light", "blinds", "thermostat", "sprinkler", "ev_charger"]
+    return [
+        {
+            "id": f"device_{i}",
+            "type": types[i % len(types)],
+            "room": f"room_{i % 200}",
+            "state": "on" if i % 2 else "off",
+            "properties": {"brightness": i % 100, "color_temp": 2700 + i % 1300, "zone": "back_yard"},
+            "last_updated": "2024-01-01T12:00:00.000000"
+        }
+        for i in range(DEVICE_COUNT)
+    ]
+
+
+def timed(func, rounds=ROUNDS):
+    """Average wall time of func in milliseconds."""
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func()
+    return (time.perf_counter() - start) * 1000 / rounds
+
+
+def main():
+    print("=" * 60)
+    print(f"JSON codec benchmark ({DEVICE_COUNT} devices, backend: {codec.BACKEND})")
+    print("=" * 60)
+
+    devices = build_snapshot()
+    encoded = json.dumps(devices)
+    property_rows = [json.dumps(d["properties"]) for d in devices]
+
+    results = [
+        (
+            "Encode snapshot",
+            timed(lambda: json.dumps(devices).encode()),
+            timed(lambda: codec.dumps_bytes(devices))
+        ),
+        (
+            "Decode snapshot",
+            timed(lambda: json.loads(encoded)),
+            timed(lambda: codec.loads(encoded))
+        ),
+        (
+            "Decode properties per row",
+            timed(lambda: [json.loads(p) for p in property_rows]),
+            timed(lambda: [codec.loads(p) for p in property_rows])
+        ),
+    ]
+
+    print(f"\n{'Operation':<28}{'stdlib (ms)':>12}{'codec (ms)':>12}{'speedup':>10}")
+    print("-" * 62)
+    for name, baseline, fast in results:
+        print(f"{name:<28}{baseline:>12.2f}{fast:>12.2f}{baseline / fast:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
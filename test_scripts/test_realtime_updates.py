@@ -13,6 +13,7 @@ if sys.platform == "win32":
 sys.path.insert(0, str(Path(__file__).parent))
 
 from app.db.database import db
+from app.utils.change_notify import start_change_listener
 
 
 async def test_realtime_flow():
@@ -25,11 +26,11 @@ async def test_realtime_flow():
     print("This test demonstrates how MCP tool changes flow to the frontend:")
     print()
     print("  1️⃣  MCP Tool executes (e.g., turn on light)")
-    print("  2️⃣  Database updated with new state + timestamp")
-    print("  3️⃣  FastAPI server polls database (every 100ms)")
-    print("  4️⃣  Detects timestamp change")
-    print("  5️⃣  Broadcasts to WebSocket clients")
-    print("  6️⃣  Frontend receives update and re-renders")
+    print("  2️⃣  Database triggers append a row to the changes table (new seq)")
+    print("  3️⃣  MCP server sends one UDP notification (with the seq) to FastAPI")
+    print("  4️⃣  FastAPI reads the changes after its last seq")
+    print("  5️⃣  Broadcasts the changed rows as a devices_delta message")
+    print("  6️⃣  Frontend merges the delta and re-renders")
     print()
     print("=" * 70)
     print()
@@ -38,6 +39,15 @@ async def test_realtime_flow():
     await db.connect()
     await db.initialize_schema()
     
+    # Listen where the FastAPI server would (unless it is already running)
+    notifications = asyncio.Queue()
+    try:
+        listener = await start_change_listener(notifications.put_nowait)
+    except OSError:
+        listener = None
+        print("ℹ️  Notification port in use (FastAPI server running?) - skipping the UDP check")
+        print()
+    
     try:
         # Import MCP tool after database is ready
         from app.mcp_server_stdio import control_device
@@ -45,10 +55,11 @@ async def test_realtime_flow():
         # Step 1: Get initial state
         print("📊 Step 1: Getting initial device state...")
         device_before = await db.get_device("living_room_light_main")
+        last_seq = await db.get_change_seq()
         print(f"   Device: {device_before['id']}")
         print(f"   State: {device_before['state']}")
         print(f"   Brightness: {device_before['properties'].get('brightness', 0)}%")
-        print(f"   Last Updated: {device_before['last_updated']}")
+        print(f"   Change seq: {last_seq}")
         print()
         
         # Step 2: Execute MCP tool
@@ -61,34 +72,36 @@ async def test_realtime_flow():
         print(f"   Result: {result}")
         print()
         
-        # Step 3: Verify database was updated
-        print("🔍 Step 3: Verifying database was updated...")
-        await asyncio.sleep(0.1)  # Small delay
-        device_after = await db.get_device("living_room_light_main")
-        print(f"   Device: {device_after['id']}")
-        print(f"   State: {device_after['state']}")
-        print(f"   Brightness: {device_after['properties'].get('brightness', 0)}%")
-        print(f"   Last Updated: {device_after['last_updated']}")
+        # Step 3: Check the change feed
+        print("🔍 Step 3: Reading the changes table...")
+        changes = await db.get_changes_since(last_seq)
+        for change in changes:
+            print(f"   seq {change['seq']}: {change['op']} {change['device_id']}")
+        print(f"   Recorded: {'✅ YES' if changes else '❌ NO'}")
         print()
         
-        # Step 4: Check timestamp changed
-        timestamp_changed = device_before['last_updated'] != device_after['last_updated']
-        print("⏱️  Step 4: Checking timestamp change...")
-        print(f"   Before: {device_before['last_updated']}")
-        print(f"   After:  {device_after['last_updated']}")
-        print(f"   Changed: {'✅ YES' if timestamp_changed else '❌ NO'}")
+        # Step 4: Check the UDP notification
+        print("📨 Step 4: Waiting for the UDP change notification...")
+        if listener:
+            try:
+                message = await asyncio.wait_for(notifications.get(), timeout=1.0)
+                print(f"   Received: {message['type']} up to seq {message['seq']}")
+                print("   This wakes the FastAPI change feed immediately (no polling)")
+            except asyncio.TimeoutError:
+                print("   ❌ No notification received")
+        else:
+            print("   Skipped")
         print()
         
-        # Step 5: Simulate what FastAPI polling does
-        print("📡 Step 5: Simulating FastAPI polling detection...")
-        async with db._connection.execute(
-            "SELECT MAX(last_updated) as max_time FROM devices"
-        ) as cursor:
-            row = await cursor.fetchone()
-            latest_timestamp = row[0]
-        
-        print(f"   Latest timestamp in database: {latest_timestamp}")
-        print(f"   This is what FastAPI polling detects!")
+        # Step 5: Build the delta exactly as the FastAPI change feed does
+        print("📡 Step 5: Simulating the FastAPI change feed...")
+        delta = await db.get_changes_delta(last_seq)
+        last_seq = delta["seq"]
+        print(f"   New seq: {delta['seq']}")
+        for device in delta["devices"]:
+            print(f"   Changed: {device['id']} → {device['state']} "
+                  f"({device['properties'].get('brightness', 0)}%)")
+        print(f"   Stats included: {'✅ YES' if delta['stats'] else '❌ NO'}")
         print()
         
         # Step 6: Summary
@@ -99,18 +112,16 @@ async def test_realtime_flow():
         print("What happens next (when both servers are running):")
         print()
         print("  🖥️  FastAPI Server:")
-        print("      - Polls database every 100ms")
-        print("      - Detects timestamp changed")
-        print("      - Broadcasts WebSocket message: {type: 'full_refresh'}")
+        print("      - Wakes on the UDP notification (polls only as a fallback)")
+        print("      - Reads the changes after its last seq")
+        print("      - Broadcasts: {type: 'devices_delta', devices: [...], stats, seq}")
         print()
         print("  🌐 Frontend (React):")
-        print("      - Receives WebSocket message")
-        print("      - Calls /api/devices to get updated data")
+        print("      - Receives the devices_delta message")
+        print("      - Merges the changed rows into its device list (no re-fetch)")
         print("      - Re-renders with new device states")
         print("      - User sees: Living Room Light Main is ON at 80%")
         print()
-        print("  ⚡ Total latency: < 200ms")
-        print()
         print("=" * 70)
         print()
         
@@ -127,12 +138,17 @@ async def test_realtime_flow():
             )
             await asyncio.sleep(0.05)  # 50ms between changes
         
+        delta = await db.get_changes_delta(last_seq)
+        device = delta["devices"][0]
         print()
         print("✅ All changes processed!")
-        print("   Each change updates timestamp → triggers frontend refresh")
+        print(f"   {delta['seq'] - last_seq} changes → one delta with {len(delta['devices'])} device "
+              f"({device['properties'].get('brightness', 0)}%)")
         print()
         
     finally:
+        if listener:
+            listener.close()
         await db.disconnect()
 
 
@@ -0,0 +1,234 @@
+"""Regression checks for upgrades and read-your-writes consistency.
+
+Runs under pytest or directly: python test_scripts/test_regressions.py
+Every check uses its own temporary database.
+"""
+import asyncio
+import atexit
+import sqlite3
+import sys
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, Tuple
+
+# Set UTF-8 encoding for Windows console
+if sys.platform == "win32":
+    import codecs
+    sys.stdout = codecs.getwriter("utf-8")(sys.stdout.detach())
+    sys.stderr = codecs.getwriter("utf-8")(sys.stderr.detach())
+
+# Add the project root to the path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.config import config
+from app.db.database import Database
+
+
+# Schema of databases created before the changes table, the event
+# partitions and the (room, id) / (type, id) indexes were introduced
+BASELINE_SCHEMA = """
+CREATE TABLE devices (
+    id TEXT PRIMARY KEY,
+    type TEXT NOT NULL,
+    room TEXT,
+    state TEXT NOT NULL,
+    properties TEXT,
+    last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    event_type TEXT NOT NULL,
+    device_id TEXT,
+    action TEXT,
+    metadata TEXT
+);
+CREATE TABLE home_modes (
+    mode TEXT PRIMARY KEY,
+    is_active BOOLEAN DEFAULT 0,
+    last_activated TIMESTAMP
+);
+CREATE INDEX idx_devices_room ON devices(room);
+CREATE INDEX idx_devices_type ON devices(type);
+CREATE INDEX idx_devices_state ON devices(state);
+CREATE INDEX idx_events_device_id ON events(device_id);
+CREATE INDEX idx_events_timestamp ON events(timestamp);
+"""
+
+
+def temp_db_path() -> Path:
+    """Path of a fresh database file in a temporary directory."""
+    return Path(tempfile.mkdtemp()) / "home_automation.db"
+
+
+_api: Dict[str, Any] = {}
+
+
+def api_client() -> Tuple[Any, Path]:
+    """
+    The shared TestClient for the API server and the path of its database.
+
+    The server keeps asyncio state at module level, so it is started once
+    per process on its own temporary database (tests use different devices)
+    and stopped at exit.
+    """
+    if not _api:
+        from fastapi.testclient import TestClient
+        from app.db.database import db
+        from app.main import app
+
+        path = temp_db_path()
+        config.DATABASE_PATH = db.db_path = path
+        config.STARTUP_LOCK_PATH = path.with_suffix(".lock")
+        client = TestClient(app)
+        client.__enter__()
+        atexit.register(client.__exit__, None, None, None)
+        _api.update(client=client, path=path)
+    return _api["client"], _api["path"]
+
+
+async def write_elsewhere(path: Path, device_id: str, state: str):
+    """Commit a device update through a separate connection, like the MCP server."""
+    other = Database(path)
+    await other.connect()
+    try:
+        await other.update_device(device_id, state=state)
+    finally:
+        await other.disconnect()
+
+
+def test_upgrade_baseline_database():
+    """A database with the original schema upgrades on connect + initialize_schema."""
+    path = temp_db_path()
+    connection = sqlite3.connect(path)
+    connection.executescript(BASELINE_SCHEMA)
+    connection.execute(
+        "INSERT INTO devices (id, type, room, state, properties) "
+        "VALUES ('kitchen_light', 'light', 'kitchen', 'off', '{\"brightness\": 0}')"
+    )
+    connection.execute(
+        "INSERT INTO events (id, event_type, device_id, action, timestamp) "
+        "VALUES (41, 'device_control', 'kitchen_light', 'on', '2024-01-01T08:00:00')"
+    )
+    connection.commit()
+    connection.close()
+
+    async def upgrade():
+        db = Database(path)
+        await db.connect()
+        try:
+            await db.initialize_schema()
+            devices = await db.get_devices()
+            async with db.reader() as conn:
+                async with conn.execute(
+                    "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'devices'"
+                ) as cursor:
+                    indexes = {row[0] for row in await cursor.fetchall()}
+            await db.insert_events([("test", None, "upgraded", None, "2024-01-02T08:00:00")])
+            events = (await db.query_events(event_type="test"))["events"]
+        finally:
+            await db.disconnect()
+        return devices, indexes, events[0]["id"]
+
+    devices, indexes, event_id = asyncio.run(upgrade())
+    assert [device["id"] for device in devices] == ["kitchen_light"]
+    # New events continue after the ids of the migrated events table
+    assert event_id == 42
+    assert {"idx_devices_room_id", "idx_devices_type_id"} <= indexes
+    assert not {"idx_devices_room", "idx_devices_type"} & indexes
+
+
+def test_event_ids_unique_across_partitions():
+    """A late write into an older day's partition does not reuse newer ids."""
+    path = temp_db_path()
+
+    async def write_events():
+        db = Database(path)
+        await db.connect()
+        try:
+            await db.initialize_schema()
+            await db.insert_events([("test", None, "today", None, "2024-01-02T09:00:00")])
+            # Another process flushes yesterday's buffered event afterwards
+            other = Database(path)
+            await other.connect()
+            try:
+                await other.insert_events([("test", None, "late", None, "2024-01-01T23:59:59")])
+            finally:
+                await other.disconnect()
+            await db.insert_events([("test", None, "next", None, "2024-01-02T09:00:01")])
+            return (await db.query_events(event_type="test"))["events"]
+        finally:
+            await db.disconnect()
+
+    events = asyncio.run(write_events())
+    ids = [event["id"] for event in events]
+    assert [event["action"] for event in events] == ["next", "today", "late"]
+    assert len(set(ids)) == len(ids)
+
+
+def test_get_sees_write_without_change_event():
+    """REST reads and ETags follow committed writes, not change feed delivery."""
+    client, path = api_client()
+    first = client.get("/api/devices", params={"type": "garage"})
+    etag = first.headers["etag"]
+    assert [device["state"] for device in first.json()] == ["closed"]
+
+    # No notification is sent, so only the 2s fallback poll would notice
+    asyncio.run(write_elsewhere(path, "garage_door", "open"))
+
+    second = client.get(
+        "/api/devices", params={"type": "garage"}, headers={"If-None-Match": etag}
+    )
+    assert second.status_code == 200
+    assert [device["state"] for device in second.json()] == ["open"]
+    assert second.headers["etag"] != etag
+
+
+def test_get_after_post_commands():
+    """POST /api/commands followed by GET /api/devices returns the new state."""
+    client, path = api_client()
+    first = client.get("/api/devices", params={"room": "bedroom", "type": "light"})
+    etag = first.headers["etag"]
+    assert [device["state"] for device in first.json()] == ["off"]
+
+    response = client.post(
+        "/api/commands",
+        json=[{"action": "on", "room": "bedroom", "device_type": "light"}]
+    )
+    assert response.status_code == 200
+    assert response.json()["changed"] == 1
+
+    second = client.get(
+        "/api/devices",
+        params={"room": "bedroom", "type": "light"},
+        headers={"If-None-Match": etag}
+    )
+    assert second.status_code == 200
+    assert [device["state"] for device in second.json()] == ["on"]
+    assert second.headers["etag"] != etag
+
+
+def test_resume_ahead_of_database():
+    """A client whose last_seq is ahead of the database gets a full snapshot."""
+    from app.utils.websocket_manager import ws_manager
+
+    client, _ = api_client()
+    # Like a fresh process or a follower that has not seen a change event yet
+    ws_manager.reset_replay(None)
+    with client.websocket_connect("/ws?last_seq=1000000") as websocket:
+        message = websocket.receive_json()
+    assert message["type"] == "initial_data"
+    assert message["devices"]
+
+
+if __name__ == "__main__":
+    failed = 0
+    for name, check in list(globals().items()):
+        if name.startswith("test_") and callable(check):
+            try:
+                check()
+                print(f"[OK] {name}")
+            except Exception as e:
+                failed += 1
+                print(f"[FAIL] {name}: {type(e).__name__}: {e}")
+    sys.exit(1 if failed else 0)